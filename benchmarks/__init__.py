@@ -0,0 +1,8 @@
+"""Benchmarks of the SDK, run from repository root.
+
+python -m benchmarks.run: throughput and latency of API calls against a local stub of Postmen API
+(benchmarks.stub), sequential, threaded and async, with saved results compared against a baseline.
+
+python -m benchmarks.micro: ops/sec and peak memory of JSON encoding and decoding, request preparation
+and response parsing on payloads from 1 KB to 50 MB.
+"""
@@ -0,0 +1,37 @@
+"""Async scenario of benchmarks.run (Python 3.7+, aiohttp)."""
+
+import asyncio
+
+from postmen import AsyncPostmen
+
+from .run import _timed_percentiles
+
+
+async def _run(endpoint, operation, calls, concurrency, options):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    async with AsyncPostmen('KEY', endpoint=endpoint, safe=True, **options) as api:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = asyncio.get_event_loop().time()
+                ret = await operation.call(api)
+                latencies.append(asyncio.get_event_loop().time() - start)
+                if ret is None:
+                    errors += 1
+        start = asyncio.get_event_loop().time()
+        await asyncio.gather(*[one() for _ in range(calls)])
+        elapsed = asyncio.get_event_loop().time() - start
+    return latencies, errors, elapsed
+
+
+def run_async(endpoint, operation, calls, concurrency, options):
+    """:returns: throughput and latency summary of calls run concurrency at once on one event loop
+    :rtype: dict"""
+    loop = asyncio.new_event_loop()
+    try:
+        latencies, errors, elapsed = loop.run_until_complete(_run(endpoint, operation, calls, concurrency, options))
+    finally:
+        loop.close()
+    return _timed_percentiles(latencies, errors, elapsed)
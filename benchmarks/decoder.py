@@ -0,0 +1,102 @@
+"""Compare JSONWithDatetimeDecoder with the previous decoder, which parsed every string with dateutil
+in a second recursive walk, and installed JSON backends on a 1000 labels listing.
+
+Run from repository root: python benchmarks/decoder.py
+"""
+from __future__ import print_function
+
+import sys
+import json
+import timeit
+from os import path
+
+import six
+import dateutil.parser
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from postmen.jsont import JSONWithDatetimeDecoder
+from postmen.jsonbackend import BACKENDS
+
+
+class DateutilDecoder(json.JSONDecoder):
+    """Decoder used before: walk parsed object and try dateutil.parser.parse() on every string."""
+    def decode(self, s):
+        o = json.JSONDecoder.decode(self, s)
+        return self.handleObj(o)
+
+    def handleObj(self, o):
+        if isinstance(o, dict):
+            for key in list(o.keys()):
+                o[key] = self.handleObj(o[key])
+            return o
+        if isinstance(o, list):
+            return [self.handleObj(val) for val in o]
+        if isinstance(o, six.string_types):
+            try:
+                return dateutil.parser.parse(o)
+            except:
+                pass
+        return o
+
+
+def label(n):
+    return {
+        'id': '%08d-2b2f-4f44-9e6d-6c2b2f7a6d%02d' % (n, n % 100),
+        'status': 'created',
+        'ship_date': '2016-02-01',
+        'tracking_numbers': ['1Z%016d' % n],
+        'files': {
+            'label': {
+                'paper_size': '4x6',
+                'url': 'https://sandbox-download.postmen.com/label/2016-01-31/%08d.pdf' % n,
+                'file_type': 'pdf'
+            },
+            'invoice': None
+        },
+        'rate': {
+            'shipper_account': {'id': '00000000-0000-0000-0000-000000000000', 'slug': 'dhl', 'description': 'DHL'},
+            'service_type': 'dhl_express_worldwide',
+            'charge_weight': {'value': 1.5, 'unit': 'kg'},
+            'total_charge': {'amount': 90.75, 'currency': 'HKD'},
+            'delivery_date': '2016-02-04T18:00:00+08:00',
+            'transit_time': 3,
+            'pickup_deadline': None,
+            'booking_cut_off': None,
+            'detailed_charges': [{'type': 'base', 'charge': {'amount': 90.75, 'currency': 'HKD'}}]
+        },
+        'ship_to': {'postal_code': '10001', 'city': 'New York', 'country': 'USA', 'phone': '123-456-7890'},
+        'created_at': '2016-01-31T16:45:46+00:00',
+        'updated_at': '2016-01-31T16:45:48+00:00'
+    }
+
+
+def main(count=1000, repeat=5):
+    listing = json.dumps({
+        'meta': {'code': 200, 'message': 'OK', 'details': []},
+        'data': {'next_token': None, 'limit': count, 'labels': [label(n) for n in range(count)]}
+    })
+    keys = ['created_at', 'updated_at', 'delivery_date']
+    cases = [
+        ('dateutil walk (before)', lambda: json.loads(listing, cls=DateutilDecoder)),
+        ('JSONWithDatetimeDecoder', lambda: json.loads(listing, cls=JSONWithDatetimeDecoder)),
+        ('JSONWithDatetimeDecoder keys', lambda: json.loads(listing, cls=JSONWithDatetimeDecoder, keys=keys)),
+        ('json.loads, no conversion', lambda: json.loads(listing)),
+    ]
+    data = listing.encode('utf-8')
+    for kls in BACKENDS:
+        try:
+            backend = kls()
+        except ImportError:
+            continue
+        cases.append(('%s backend, bytes' % backend.name, lambda backend=backend: backend.loads(data, True)))
+    print('%d labels, %d bytes' % (count, len(listing)))
+    base = None
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        base = base or best
+        print('%-30s %8.1f ms  x%.1f' % (name, best * 1000, base / best))
+
+
+if __name__ == '__main__':
+    main()
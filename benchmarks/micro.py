@@ -0,0 +1,220 @@
+"""Microbenchmarks of CPU bound hot paths on labels listings from 1 KB to 50 MB.
+
+Functions measured, each on every fixture size:
+    encode: json.dumps() with JSONWithDatetimeEncoder of a listing holding datetime objects
+    decode: json.loads() with JSONWithDatetimeDecoder
+    handleObj: JSONWithDatetimeDecoder.handleObj() of an already parsed listing
+    _get_requests_params: Postmen._get_requests_params() with listing as body and datetime query values
+    _response: Postmen._response() of a buffered response with x-ratelimit-* headers, time=True
+
+Reported are ops/sec (setup of every op, e.g. copying inputs mutated in place, is not timed) and
+peak memory allocated by one op, traced by tracemalloc in a separate run (Python 3 only).
+
+Run from repository root:
+    python -m benchmarks.micro --output micro.json
+    python -m benchmarks.micro --sizes 1KB 1MB --functions decode --baseline micro.json
+"""
+from __future__ import print_function
+
+import re
+import sys
+import copy
+import json
+import datetime
+import platform
+import argparse
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from postmen import Postmen
+from postmen.jsont import JSONWithDatetimeEncoder
+from postmen.jsont import JSONWithDatetimeDecoder
+from postmen.buffered import BufferedResponse
+from postmen.ratelimit import _monotonic
+
+from .decoder import label
+
+SIZES = ['1KB', '64KB', '1MB', '10MB', '50MB']
+_UNITS = {'': 1, 'KB': 1024, 'MB': 1024 * 1024}
+_HEADERS = {
+    'content-type': 'application/json; charset=utf-8',
+    'x-ratelimit-limit': '10',
+    'x-ratelimit-remaining': '9',
+    'x-ratelimit-reset': '1454312400000'
+}
+
+
+def _parse_size(size):
+    m = re.match(r'^(\d+)\s*(KB|MB|)$', size.upper())
+    if m is None:
+        raise ValueError('size must look like 512, 64KB or 10MB, not %r' % size)
+    return int(m.group(1)) * _UNITS[m.group(2)]
+
+
+class Fixture(object):
+    """Labels listing API response of about size bytes, in every form the measured functions take.
+
+    :ivar text: response JSON
+    :ivar content: response JSON encoded to bytes
+    :ivar parsed: response parsed without datetime conversion
+    :ivar data: response data with datetime objects
+    """
+    def __init__(self, size):
+        one = len(json.dumps(label(0)))
+        count = max(1, size // one)
+        self.text = json.dumps({
+            'meta': {'code': 200, 'message': 'OK', 'details': []},
+            'data': {'next_token': None, 'limit': count, 'labels': [label(n) for n in range(count)]}
+        }, separators=(',', ':'))
+        self.content = self.text.encode('utf-8')
+        self.parsed = json.loads(self.text)
+        self.data = json.loads(self.text, cls=JSONWithDatetimeDecoder)['data']
+        self.count = count
+
+
+def _cases(fixture):
+    # name -> (setup returning args of one op, op)
+    api = Postmen('KEY', endpoint='http://127.0.0.1:1')
+    decoder = JSONWithDatetimeDecoder()
+    response = BufferedResponse(200, _HEADERS, fixture.content)
+    query = {'limit': fixture.count, 'created_at_min': datetime.datetime(2016, 1, 31, 16, 45, 46), 'status': 'created'}
+    return [
+        ('encode', lambda: (fixture.data,), lambda o: json.dumps(o, cls=JSONWithDatetimeEncoder)),
+        ('decode', lambda: (fixture.text,), lambda s: json.loads(s, cls=JSONWithDatetimeDecoder)),
+        # handleObj converts in place, every op gets its own copy
+        ('handleObj', lambda: (copy.deepcopy(fixture.parsed),), decoder.handleObj),
+        ('_get_requests_params', lambda: (dict(query),),
+            lambda q: api._get_requests_params('POST', 'labels', body=fixture.data, query=q)),
+        ('_response', lambda: (response,), lambda r: api._response(r, time=True))
+    ]
+
+
+def _ops_per_sec(setup, op, min_time, min_ops):
+    elapsed = 0.0
+    ops = 0
+    while elapsed < min_time or ops < min_ops:
+        args = setup()
+        start = _monotonic()
+        op(*args)
+        elapsed += _monotonic() - start
+        ops += 1
+    return ops, elapsed
+
+
+def _peak_memory(setup, op):
+    # bytes allocated by one op on top of its inputs, None without tracemalloc
+    if tracemalloc is None:
+        return None
+    args = setup()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = op(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak - before
+
+
+def run(sizes=None, functions=None, min_time=1.0, min_ops=3):
+    """Build fixtures and measure every function on every of them.
+
+    :param sizes: fixture sizes, e.g. ['1KB', '10MB'], None for SIZES
+    :param functions: names of functions to measure, None for all
+    :param min_time: seconds every function is run for at least
+    :param min_ops: ops every function is run at least
+    :rtype: dict"""
+    results = {}
+    for size in sizes or SIZES:
+        fixture = Fixture(_parse_size(size))
+        for name, setup, op in _cases(fixture):
+            if functions and name not in functions:
+                continue
+            ops, elapsed = _ops_per_sec(setup, op, min_time, min_ops)
+            results['%s/%s' % (name, size)] = {
+                'bytes': len(fixture.content),
+                'ops': ops,
+                'seconds': elapsed,
+                'ops_per_sec': ops / elapsed if elapsed > 0 else None,
+                'mb_per_sec': ops * len(fixture.content) / elapsed / _UNITS['MB'] if elapsed > 0 else None,
+                'peak_memory': _peak_memory(setup, op)
+            }
+        del fixture
+    return {
+        'meta': {
+            'date': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'min_time': min_time,
+            'min_ops': min_ops
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """:returns: regressions, (name, metric, baseline value, current value) for every ops/sec drop or
+        peak memory growth above tolerance, for benchmarks present in both results
+    :rtype: list"""
+    regressions = []
+    for name, current in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if base['ops_per_sec'] and current['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append((name, 'ops_per_sec', base['ops_per_sec'], current['ops_per_sec']))
+        if base['peak_memory'] and current['peak_memory'] and current['peak_memory'] > base['peak_memory'] * (1 + tolerance):
+            regressions.append((name, 'peak_memory', base['peak_memory'], current['peak_memory']))
+    return regressions
+
+
+def _sort_key(item):
+    function, size = item[0].rsplit('/', 1)
+    return function, _parse_size(size)
+
+
+def _report(results, baseline=None):
+    print('%-30s %11s %11s %9s %12s %10s' % ('benchmark', 'bytes', 'ops/s', 'MB/s', 'peak KB', 'base ops/s'))
+    for name, r in sorted(results['results'].items(), key=_sort_key):
+        base = baseline['results'].get(name, {}).get('ops_per_sec') if baseline else None
+        print('%-30s %11d %11.1f %9.1f %12s %10s' % (
+            name, r['bytes'], r['ops_per_sec'] or 0, r['mb_per_sec'] or 0,
+            '%.1f' % (r['peak_memory'] / 1024.0) if r['peak_memory'] is not None else '-',
+            '%.1f' % base if base else '-'
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Postmen SDK microbenchmarks of JSON and request handling')
+    parser.add_argument('--sizes', nargs='*', help='fixture sizes (default %s)' % ' '.join(SIZES))
+    parser.add_argument('--functions', nargs='*', help='encode, decode, handleObj, _get_requests_params, _response (default all)')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds every function runs at least')
+    parser.add_argument('--min-ops', type=int, default=3, help='ops every function runs at least')
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results saved before')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression')
+    args = parser.parse_args(argv)
+    results = run(args.sizes, args.functions, args.min_time, args.min_ops)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    _report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, base, current in regressions:
+            print('REGRESSION %s %s: %.4g -> %.4g' % (name, metric, base, current))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
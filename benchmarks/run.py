@@ -0,0 +1,248 @@
+"""Measure throughput and tail latency of API calls against the local Postmen API stub.
+
+Every operation (get_label, create_label, list_labels, create_rate) is run in every scenario:
+sequential (one thread), threaded (one Postmen object shared by --threads threads) and async
+(AsyncPostmen, --threads calls in flight, Python 3.7+ with aiohttp).
+
+Run from repository root:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json --tolerance 0.15
+
+With --baseline, exit status is 1 if throughput dropped or p99 latency grew by more than tolerance.
+"""
+from __future__ import print_function
+
+import sys
+import json
+import platform
+import datetime
+import argparse
+import threading
+
+from postmen import Postmen
+from postmen.retry import RetryPolicy
+from postmen.ratelimit import _monotonic
+
+from .stub import StubServer
+
+LABEL_PAYLOAD = {
+    'service_type': 'dhl_express_worldwide',
+    'is_document': False,
+    'paper_size': '4x6',
+    'shipper_account': {'id': 'd2c4d66c-a7e9-4ba6-a3b3-9a3fd9ac6f42'},
+    'references': ['order-1234567'],
+    'shipment': {
+        'ship_from': {'contact_name': 'Sender', 'street1': 'Street 1', 'city': 'Hong Kong', 'country': 'HKG', 'phone': '96679797', 'type': 'business'},
+        'ship_to': {'contact_name': 'Receiver', 'street1': '71 Terrace Crescent NE', 'city': 'Medicine Hat', 'state': 'Alberta', 'postal_code': 'T1C1Z9', 'country': 'CAN', 'phone': '1-403-504-5496', 'type': 'residential'},
+        'parcels': [{
+            'box_type': 'custom',
+            'weight': {'value': 1.5, 'unit': 'kg'},
+            'dimension': {'width': 20, 'height': 30, 'depth': 40, 'unit': 'cm'},
+            'items': [{'description': 'Food Bar', 'origin_country': 'USA', 'quantity': 2, 'price': {'amount': 50, 'currency': 'USD'}, 'weight': {'value': 0.6, 'unit': 'kg'}, 'sku': 'Epic_Food_Bar'}]
+        }]
+    }
+}
+
+
+class Operation(object):
+    """API call measured by the benchmarks."""
+    def __init__(self, name, method, args, kwargs=None):
+        self.name = name
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs or {}
+
+    def call(self, api):
+        """:returns: call result, a coroutine for AsyncPostmen"""
+        return getattr(api, self.method)(*self.args, **self.kwargs)
+
+
+OPERATIONS = [
+    Operation('get_label', 'get', ('labels', 'd2c4d66c-a7e9-4ba6-a3b3-9a3fd9ac6f42')),
+    Operation('create_label', 'create', ('labels', LABEL_PAYLOAD)),
+    Operation('list_labels', 'get', ('labels',), {'query': {'limit': 20}}),
+    Operation('create_rate', 'create', ('rates', {'shipper_accounts': [{'id': 'd2c4d66c-a7e9-4ba6-a3b3-9a3fd9ac6f42'}], 'shipment': LABEL_PAYLOAD['shipment']}))
+]
+
+
+def _percentile(values, share):
+    if not values:
+        return None
+    index = min(int(round(share * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def _timed_percentiles(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'calls': len(latencies),
+        'errors': errors,
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed > 0 else None,
+        'p50': _percentile(latencies, 0.5),
+        'p90': _percentile(latencies, 0.9),
+        'p99': _percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None
+    }
+
+
+def _calls(api, operation, calls, latencies):
+    errors = 0
+    for _ in range(calls):
+        start = _monotonic()
+        ret = operation.call(api)
+        latencies.append(_monotonic() - start)
+        if ret is None:
+            errors += 1
+    return errors
+
+
+def run_sequential(endpoint, operation, calls, concurrency, options):
+    """:returns: throughput and latency summary of calls made one after another
+    :rtype: dict"""
+    with Postmen('KEY', endpoint=endpoint, safe=True, **options) as api:
+        latencies = []
+        start = _monotonic()
+        errors = _calls(api, operation, calls, latencies)
+        return _timed_percentiles(latencies, errors, _monotonic() - start)
+
+
+def run_threaded(endpoint, operation, calls, concurrency, options):
+    """:returns: throughput and latency summary of calls made by concurrency threads sharing one Postmen object
+    :rtype: dict"""
+    with Postmen('KEY', endpoint=endpoint, safe=True, pool_maxsize=concurrency, **options) as api:
+        latencies = []
+        errors = []
+        share = [calls // concurrency + (1 if i < calls % concurrency else 0) for i in range(concurrency)]
+
+        def worker(n):
+            errors.append(_calls(api, operation, n, latencies))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in share]
+        start = _monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return _timed_percentiles(latencies, sum(errors), _monotonic() - start)
+
+
+def _scenarios():
+    scenarios = [('sequential', run_sequential), ('threaded', run_threaded)]
+    if sys.version_info >= (3, 7):
+        try:
+            import aiohttp
+        except ImportError:
+            return scenarios
+        from .aio import run_async
+        scenarios.append(('async', run_async))
+    return scenarios
+
+
+def run(scenarios=None, operations=None, calls=200, concurrency=8, stub_options=None, postmen_options=None):
+    """Start stub, run benchmarks and return results.
+
+    :param scenarios: names of scenarios to run, None for all available
+    :param operations: names of operations to run, None for all
+    :param calls: calls per scenario and operation
+    :param concurrency: threads or calls in flight of threaded and async scenarios
+    :param stub_options: StubServer params
+    :param postmen_options: Postmen params
+    :rtype: dict"""
+    stub_options = stub_options or {}
+    postmen_options = dict(postmen_options or {})
+    # fast retries, benchmarks measure the SDK, not backoff delays
+    postmen_options.setdefault('retry_policy', RetryPolicy(base=0.01, cap=0.05, budget=None))
+    server = StubServer(**stub_options)
+    results = {}
+    try:
+        for scenario, runner in _scenarios():
+            if scenarios and scenario not in scenarios:
+                continue
+            for operation in OPERATIONS:
+                if operations and operation.name not in operations:
+                    continue
+                results['%s/%s' % (scenario, operation.name)] = runner(server.url, operation, calls, concurrency, postmen_options)
+    finally:
+        server.close()
+    return {
+        'meta': {
+            'date': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'calls': calls,
+            'concurrency': concurrency,
+            'stub': stub_options,
+            'stub_requests': server.requests
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """:returns: regressions, (name, metric, baseline value, current value) for every throughput drop or p99 growth
+        above tolerance, for benchmarks present in both results
+    :rtype: list"""
+    regressions = []
+    for name, current in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if base['throughput'] and current['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append((name, 'throughput', base['throughput'], current['throughput']))
+        if base['p99'] and current['p99'] > base['p99'] * (1 + tolerance):
+            regressions.append((name, 'p99', base['p99'], current['p99']))
+    return regressions
+
+
+def _report(results, baseline=None):
+    print('%-26s %8s %7s %10s %9s %9s %9s %9s' % ('benchmark', 'calls', 'errors', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms', 'base/s'))
+    for name, r in sorted(results['results'].items()):
+        base = baseline['results'].get(name, {}).get('throughput') if baseline else None
+        print('%-26s %8d %7d %10.1f %9.2f %9.2f %9.2f %9s' % (
+            name, r['calls'], r['errors'], r['throughput'] or 0,
+            r['p50'] * 1000, r['p90'] * 1000, r['p99'] * 1000,
+            '%.1f' % base if base else '-'
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Postmen SDK benchmarks against local API stub')
+    parser.add_argument('--scenarios', nargs='*', help='sequential, threaded, async (default all)')
+    parser.add_argument('--operations', nargs='*', help=', '.join(operation.name for operation in OPERATIONS) + ' (default all)')
+    parser.add_argument('--calls', type=int, default=200, help='calls per scenario and operation')
+    parser.add_argument('--threads', type=int, default=8, help='threads or async calls in flight')
+    parser.add_argument('--latency', type=float, default=0.0, help='stub latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='stub random extra latency, seconds')
+    parser.add_argument('--size', type=int, default=20, help='objects in stub lists')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of retryable stub errors')
+    parser.add_argument('--rate-limit', type=int, default=None, help='stub calls per rate window')
+    parser.add_argument('--json-backend', default='stdlib', help='Postmen json_backend')
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results saved before')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression')
+    args = parser.parse_args(argv)
+    stub_options = {
+        'latency': args.latency, 'jitter': args.jitter, 'size': args.size,
+        'error_rate': args.error_rate, 'rate_limit': args.rate_limit
+    }
+    results = run(args.scenarios, args.operations, args.calls, args.threads, stub_options, {'json_backend': args.json_backend})
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    _report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, base, current in regressions:
+            print('REGRESSION %s %s: %.4g -> %.4g' % (name, metric, base, current))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""Local stub of Postmen API serving realistic label, rate and manifest responses.
+
+Routes (under /v3):
+    POST labels, GET labels/<id>: label object
+    GET labels: list of labels
+    POST rates: rate quote with rates of several services
+    POST manifests, GET manifests: manifest object and list
+
+Run standalone: python -m benchmarks.stub --port 8080 --latency 0.05 --error-rate 0.01
+"""
+from __future__ import print_function
+
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+
+def _label(id_=None):
+    return {
+        'id': id_ or str(uuid.uuid4()),
+        'status': 'created',
+        'ship_date': '2016-02-01',
+        'tracking_numbers': ['RI123456789CN'],
+        'files': {
+            'label': {'paper_size': '4x6', 'url': 'https://sandbox-download.postmen.com/label/2016-02-01/label.pdf', 'file_type': 'pdf'},
+            'invoice': {'paper_size': 'a4', 'url': 'https://sandbox-download.postmen.com/invoice/2016-02-01/invoice.pdf', 'file_type': 'pdf'},
+            'customs_declaration': None,
+            'manifest': None
+        },
+        'rate': {
+            'shipper_account': {'id': 'd2c4d66c-a7e9-4ba6-a3b3-9a3fd9ac6f42', 'slug': 'dhl', 'description': 'DHL account'},
+            'service_type': 'dhl_express_worldwide',
+            'service_name': 'DHL Express Worldwide',
+            'pickup_deadline': None,
+            'booking_cut_off': None,
+            'delivery_date': '2016-02-03T23:59:59+00:00',
+            'transit_time': 2,
+            'error_message': None,
+            'info_message': None,
+            'charge_weight': {'value': 1.5, 'unit': 'kg'},
+            'total_charge': {'amount': 93.71, 'currency': 'USD'},
+            'detailed_charges': [{'type': 'base', 'charge': {'amount': 87.4, 'currency': 'USD'}}, {'type': 'fuel_surcharge', 'charge': {'amount': 6.31, 'currency': 'USD'}}]
+        },
+        'references': ['order-1234567'],
+        'created_at': '2016-02-01T07:45:58+00:00',
+        'updated_at': '2016-02-01T07:46:07+00:00'
+    }
+
+
+def _rate_quote(services):
+    label = _label()
+    rates = []
+    for i in range(services):
+        rate = dict(label['rate'], service_type='service_%d' % i, service_name='Service %d' % i)
+        rates.append(rate)
+    return {
+        'id': str(uuid.uuid4()),
+        'status': 'calculated',
+        'rates': rates,
+        'created_at': '2016-02-01T07:45:58+00:00',
+        'updated_at': '2016-02-01T07:45:59+00:00'
+    }
+
+
+def _manifest(labels):
+    return {
+        'id': str(uuid.uuid4()),
+        'status': 'manifested',
+        'shipper_account': {'id': 'd2c4d66c-a7e9-4ba6-a3b3-9a3fd9ac6f42'},
+        'files': {'manifest': {'paper_size': 'a4', 'url': 'https://sandbox-download.postmen.com/manifest/manifest.pdf', 'file_type': 'pdf'}},
+        'labels': [{'id': str(uuid.uuid4())} for _ in range(labels)],
+        'created_at': '2016-02-01T07:45:58+00:00',
+        'updated_at': '2016-02-01T07:46:07+00:00'
+    }
+
+
+def _envelope(data):
+    return {'meta': {'code': 200, 'message': 'OK', 'details': []}, 'data': data}
+
+
+class StubServer(object):
+    """Threaded HTTP/1.1 stub of Postmen API on 127.0.0.1, started on creation.
+
+    :param latency: seconds added to every response
+    :type latency: float
+    :param jitter: random extra latency up to this many seconds
+    :type jitter: float
+    :param size: number of objects in lists and rates in a rate quote
+    :type size: int
+    :param error_rate: share of requests answered with retryable 500 error
+    :type error_rate: float
+    :param rate_limit: calls allowed per rate_window (x-ratelimit-* headers, 429 once exceeded), None for no limit
+    :type rate_limit: int
+    :param rate_window: rate limit window, seconds
+    :type rate_window: float
+    :param port: port to listen on, 0 for any free one
+    :type port: int
+    :param seed: random seed of latency jitter and errors
+    :type seed: int
+    """
+    def __init__(self, latency=0.0, jitter=0.0, size=20, error_rate=0.0, rate_limit=None, rate_window=1.0, port=0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.size = size
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.requests = 0
+        self.errors = 0
+        self.limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_calls = 0
+        # bodies are prepared once, so the stub does not dominate measured time
+        self._bodies = {
+            'label': json.dumps(_envelope(_label())).encode('utf-8'),
+            'labels': json.dumps(_envelope({'limit': size, 'labels': [_label() for _ in range(size)]})).encode('utf-8'),
+            'rates': json.dumps(_envelope(_rate_quote(size))).encode('utf-8'),
+            'manifest': json.dumps(_envelope(_manifest(size))).encode('utf-8'),
+            'manifests': json.dumps(_envelope({'limit': size, 'manifests': [_manifest(1) for _ in range(size)]})).encode('utf-8'),
+            'error': b'{"meta":{"code":5001,"message":"Internal error","retryable":true,"details":[]},"data":{}}',
+            'limited': b'{"meta":{"code":429,"message":"Too many requests","retryable":true,"details":[]},"data":{}}',
+            'not_found': b'{"meta":{"code":4153,"message":"Resource not found","retryable":false,"details":[]},"data":{}}'
+        }
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, Nagle would hold the body for delayed ACK
+            disable_nagle_algorithm = True
+
+            def _serve(self, method):
+                length = int(self.headers.get('content-length') or 0)
+                if length:
+                    self.rfile.read(length)
+                status, body, headers = stub._answer(method, self.path.split('?', 1)[0])
+                self.send_response(status)
+                self.send_header('content-type', 'application/json; charset=utf-8')
+                self.send_header('content-length', str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._serve('GET')
+
+            def do_POST(self):
+                self._serve('POST')
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self._server = Server(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _rate_limit_headers(self):
+        # returns headers and False once the window quota is used up
+        if self.rate_limit is None:
+            return [], True
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_calls = 0
+            self._window_calls += 1
+            remaining = self.rate_limit - self._window_calls
+            reset = int(math.ceil((self._window_start + self.rate_window) * 1000))
+        headers = [
+            ('x-ratelimit-limit', str(self.rate_limit)),
+            ('x-ratelimit-remaining', str(max(remaining, 0))),
+            ('x-ratelimit-reset', str(reset))
+        ]
+        return headers, remaining >= 0
+
+    def _answer(self, method, path):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        headers, allowed = self._rate_limit_headers()
+        if not allowed:
+            with self._lock:
+                self.limited += 1
+            return 429, self._bodies['limited'], headers
+        if failed:
+            with self._lock:
+                self.errors += 1
+            return 500, self._bodies['error'], headers
+        parts = path.strip('/').split('/')[1:]
+        resource = parts[0] if parts else ''
+        if resource == 'labels':
+            key = 'labels' if method == 'GET' and len(parts) == 1 else 'label'
+        elif resource == 'rates':
+            key = 'rates'
+        elif resource == 'manifests':
+            key = 'manifests' if method == 'GET' and len(parts) == 1 else 'manifest'
+        else:
+            return 404, self._bodies['not_found'], headers
+        return 200, self._bodies[key], headers
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stub of Postmen API')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, seconds')
+    parser.add_argument('--size', type=int, default=20, help='objects in lists and rates in a quote')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of retryable 500 responses')
+    parser.add_argument('--rate-limit', type=int, default=None, help='calls per window, 429 once exceeded')
+    parser.add_argument('--rate-window', type=float, default=1.0, help='rate limit window, seconds')
+    args = parser.parse_args(argv)
+    server = StubServer(args.latency, args.jitter, args.size, args.error_rate, args.rate_limit, args.rate_window, args.port)
+    print('Postmen API stub listening on %s' % server.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,8 +3,12 @@ from __future__ import print_function
 """Postmen and PostmenException classes are intended for SDK users.
 """
 
+import os
+import re
 import sys
-import json
+import zlib
+import hashlib
+import tempfile
 import time as time_module
 import datetime
 import traceback
@@ -12,9 +16,27 @@ import threading
 
 import six
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
-from .jsont import JSONWithDatetimeEncoder
-from .jsont import JSONWithDatetimeDecoder
+from .jsonbackend import get_backend
+from .ratelimit import RateLimiter
+from .ratelimit import PacingRateLimiter
+from .ratelimit import SharedRateLimiter
+from .ratelimit import RateLimitExceeded
+from .ratelimit import _monotonic
+from .retry import RetryPolicy
+from .retry import RetryBudget
+from .cache import ResponseCache
+from .cache import RateQuoteCache
+from .cache import payload_hash
+from .buffered import BufferedResponse
+from .stream import JSONArrayStream
+from .middleware import CallContext
+from .cassette import request_key
+from .tracing import Tracer
+from .tracing import TimedHTTPAdapter
 if six.PY2:
     from .rp2 import _raise
 else:
@@ -34,8 +56,8 @@ class PostmenException(Exception):
             self.a['meta']['message'] = message
         code = kwarg.get('code', None)
         self._setDefault('code', code)
-        self._setDefault('details', [])
-        self._setDefault('retryable', False)
+        self._setDefault('details', kwarg.get('details', []))
+        self._setDefault('retryable', kwarg.get('retryable', False))
         self._setDefault('message', 'no details')
 
 
@@ -77,8 +99,94 @@ class PostmenException(Exception):
         :rtype: dict"""
         return self.a['data']
 
+# meta must be the first key of the top level object, a nested "meta" in data is never taken for it
+_META_CODE = re.compile(br'\s*\{\s*"meta"\s*:\s*\{[^{}]*?"code"\s*:\s*(\d+)')
+
+
+def _meta_code_ok(content):
+    # meta.code found without parsing the body, False if it is not found or is an error
+    m = _META_CODE.match(content)
+    if m is None:
+        return False
+    code = int(m.group(1))
+    return code == 200 or code // 1000 == 3
+
+
+_COMPRESS_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def _wire_bytes(response):
+    # size of the body as received, before decompression
+    raw = getattr(response, 'raw', None)
+    if raw is not None and hasattr(raw, 'tell'):
+        return raw.tell()
+    length = response.headers.get('content-length', '')
+    return int(length) if length.isdigit() else len(response.content)
+
+
+# atomic rename over existing file, os.rename does it on POSIX only
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _label_file_name(label_id, label_file):
+    url_name = os.path.basename(six.moves.urllib.parse.urlparse(label_file['url']).path)
+    if not label_id:
+        return url_name
+    file_type = label_file.get('file_type') or os.path.splitext(url_name)[1].lstrip('.') or 'pdf'
+    return '%s.%s' % (label_id, file_type)
+
+
+def _bind_send(middleware, context, send):
+    return lambda params: middleware.send(context, params, send)
+
+
+def _prefetch(iterable, size):
+    """Iterate over iterable in a background thread, keeping up to size items ready ahead of the consumer."""
+    items = six.moves.queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except six.moves.queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+class PostmenDeadlineException(PostmenException):
+    """Call deadline passed before API call could be completed. Retryable, as the API did not reject the call."""
+    def __init__(self, message=None, **kwarg):
+        kwarg.setdefault('code', 408)
+        kwarg.setdefault('retryable', True)
+        super(PostmenDeadlineException, self).__init__(message, **kwarg)
+
 class Postmen(object):
-    """Postmen calls handler.
+    """Postmen calls handler. One instance (and its connection pool) may be shared by many threads.
 
     :param api_key: Postmen API key
     :type api_key: str or unicode
@@ -92,48 +200,164 @@ class Postmen(object):
     :type x_agent: str or unicode
     :param retries: number of calls retries in case of retriable errors
     :type retries: int
-    :param raw: True to exclude parsing of response JSON strings
-    :type raw: bool
+    :param raw: True to exclude parsing of response JSON strings, 'bytes' to return response body undecoded
+    :type raw: bool or str
     :param safe: True to suppress exceptions on API calls (only). Use getError() instead
     :type safe: bool
-    :param time: True to convert ISO time strings to datetime.datetime
-    :type time: bool
+    :param time: True to convert ISO time strings to datetime.datetime, list of keys to convert values of these keys only
+    :type time: bool or list
     :param proxy: Proxy for HTTP calls
     :type proxy: dictionary like in http://docs.python-requests.org/en/latest/user/advanced/#proxies
     :param retry: True to retry calls in case of retriable errors
     :type retry: bool
+    :param pool_connections: number of per-host connection pools to keep
+    :type pool_connections: int
+    :param pool_maxsize: maximum number of connections kept alive per host
+    :type pool_maxsize: int
+    :param keep_alive: False to close HTTP connection after every call
+    :type keep_alive: bool
+    :param stale_retries: number of transparent resends when a pooled connection was dropped by the server
+    :type stale_retries: int
+    :param pacing: True to spread calls evenly over the rate limit window instead of waiting for reset once quota is used up
+    :type pacing: bool
+    :param rate_limiter: rate limit tracker, overwrite pacing setting
+    :type rate_limiter: postmen.ratelimit.RateLimiter
+    :param retry_policy: retry delays and error classification, default is RetryPolicy() sharing the process wide retry budget
+    :type retry_policy: postmen.retry.RetryPolicy
+    :param timeout: HTTP connect and read timeouts in seconds, single number for both, None to wait forever
+    :type timeout: float or tuple
+    :param deadline: seconds one call may take including rate limit waits, retries and delays, None for no limit
+    :type deadline: float
+    :param json_backend: JSON encoder and decoder: stdlib, orjson, rapidjson, ujson or auto for the fastest one installed
+    :type json_backend: str or unicode
+    :param cache: cache of GET responses, per call cache=False skips it and cache='refresh' replaces cached response
+    :type cache: postmen.cache.ResponseCache
+    :param rate_cache: cache of rate quotes (POST /rates) keyed by canonical payload, per call cache option applies as well
+    :type rate_cache: postmen.cache.RateQuoteCache
+    :param compress: gzip or deflate to compress request bodies, None to send them as is
+    :type compress: str or unicode
+    :param compress_threshold: minimal size of request body to compress, bytes
+    :type compress_threshold: int
+    :param label_cache: disk cache of label files used by get_label_file()
+    :type label_cache: postmen.cache.LabelFileCache
+    :param middleware: hooks run around every call, in list order
+    :type middleware: list of postmen.middleware.Middleware
+    :param cassette: recorded responses to answer calls with, or to record responses to
+    :type cassette: postmen.cassette.Cassette
 
     :raises PostmenException: if API is missed
     :raises PostmenException: if region or endpoint is missed
     :raises PostmenException: if version is missed
     """
+    # cancelling a label changes the label status
+    _related_resources = {'cancel-labels': ('cancel-labels', 'labels')}
+
     def __init__(
         self, api_key, region=None, endpoint=None,
-        raw=False, safe=False, time=False, proxy={}, retry=True, rate = True
+        raw=False, safe=False, time=False, proxy={}, retry=True, rate = True,
+        pool_connections=10, pool_maxsize=10, keep_alive=True, stale_retries=1,
+        pacing=False, rate_limiter=None, retry_policy=None, timeout=(10, 60), deadline=None,
+        json_backend='stdlib', cache=None, rate_cache=None, compress=None, compress_threshold=1024,
+        label_cache=None, middleware=None, cassette=None
     ):
         e = None
         if not api_key:
             e = PostmenException(message='missed API key')
         if not region and not endpoint:
             e = PostmenException(message='missed region')
-        self._retries = 5
+        try:
+            self._json = get_backend(json_backend)
+        except (ImportError, ValueError) as err:
+            self._json = get_backend('stdlib')
+            e = PostmenException(message='JSON backend %s is not available: %s' % (json_backend, err))
+        if compress and compress not in _COMPRESS_WBITS:
+            e = PostmenException(message='unknown compression %s' % compress)
+            compress = None
+        self._retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self._retries = self._retry_policy.tries
+        # rate limit bookkeeping is shared by all threads, last error is per thread
+        self._local = threading.local()
         self._error = None
         self._version = 'v3'
-        self._calls_left = None
-        self._time_before_reset = None
         self._endpoint = endpoint if endpoint else 'https://%s-api.postmen.com' % region
         self._headers = {'content-type': 'application/json'}
         self._headers['postmen-api-key'] = api_key
+        # cached responses are per account, caches may be shared by Postmen objects with different keys
+        account = api_key or ''
+        if isinstance(account, six.text_type):
+            account = account.encode('utf-8')
+        self._account = hashlib.sha256(account).hexdigest()
         self._headers['x-postmen-agent'] = 'python-sdk-1.3'
+        self._headers['accept-encoding'] = 'gzip, deflate'
         self._raw = raw
         self._safe = safe
         self._time = time
         self._proxy = proxy
         self._retry = retry
         self._rate = rate
+        self._timeout = timeout
+        self._cache = cache
+        self._rate_cache = rate_cache
+        self._deadline = deadline
+        self._compress = compress
+        self._compress_threshold = compress_threshold
+        self._label_cache = label_cache
+        self._middleware = list(middleware or [])
+        self._cassette = cassette
+        if rate_limiter is None:
+            rate_limiter = PacingRateLimiter() if pacing else RateLimiter()
+        self._rate_limiter = rate_limiter
+        if not keep_alive:
+            self._headers['connection'] = 'close'
+        self._session = self._create_session(pool_connections, pool_maxsize, stale_retries)
         if e is not None :
             self._report_error(e, self._safe)
 
+    @property
+    def _error(self):
+        return getattr(self._local, 'error', None)
+
+    @_error.setter
+    def _error(self, value):
+        self._local.error = value
+
+    @property
+    def _byte_counts(self):
+        return getattr(self._local, 'byte_counts', None)
+
+    @_byte_counts.setter
+    def _byte_counts(self, value):
+        self._local.byte_counts = value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _create_session(self, pool_connections, pool_maxsize, stale_retries):
+        # urllib3 resends on dropped connections, read errors are resent
+        # for idempotent methods only so POST is never replayed
+        max_retries = Retry(
+            total=stale_retries, connect=stale_retries, read=stale_retries,
+            status=0, redirect=0, raise_on_status=False
+        )
+        # connect time of new connections is measured only when a Tracer reads it
+        traced = any(isinstance(middleware, Tracer) for middleware in self._middleware)
+        adapter = (TimedHTTPAdapter if traced else HTTPAdapter)(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        """Close all pooled HTTP connections. Postmen instance may be used as a context manager instead."""
+        self._session.close()
+
     def _delay(self, sec):
         time_module.sleep(sec)
 
@@ -143,41 +367,35 @@ class Postmen(object):
         if 'meta' not in kwargs:
             kwargs['meta'] = {}
         kwargs['meta']['traceback'] = traceback
-        pe = PostmenException(**kwargs)
+        kls = e.__class__ if isinstance(e, PostmenException) else PostmenException
+        pe = kls(**kwargs)
         if safe:
             self._error = pe
             return None
         _raise(pe, e, traceback)
 
     def _response(self, response, **kwargs):
-        raw   = kwargs.get('raw', self._raw)
-        time  = kwargs.get('time', self._time)
-
         # print(response.headers)
         # print(response.text)
 
-        sec_before_reset = response.headers.get('x-ratelimit-reset', '0')
-        sec_before_reset = int(sec_before_reset) / 1000
-        # print(sec_before_reset)
-        if sec_before_reset:
-            if not self._time_before_reset or self._time_before_reset < sec_before_reset:
-                self._time_before_reset = int(sec_before_reset)
-
-        self._calls_left = response.headers.get('x-ratelimit-remaining', self._calls_left)
-        if self._calls_left:
-            self._calls_left = int(self._calls_left)
+        self._rate_limiter.update(response.headers)
+        return self._parse_response(response, **kwargs)
 
-        # print('self._time_before_reset', self._time_before_reset)
-        # print('self._calls_left', self._calls_left)
+    def _parse_response(self, response, **kwargs):
+        raw   = kwargs.get('raw', self._raw)
+        time  = kwargs.get('time', self._time)
 
-        if response.text:
-            if raw:
+        if response.content:
+            if raw == 'bytes' and _meta_code_ok(response.content):
+                ret = response.content
+            elif raw and raw != 'bytes':
                 ret = response.text
             else:
-                kls = JSONWithDatetimeDecoder if time else json.JSONDecoder
                 try :
-                    ret = json.loads(response.text, cls=kls)
+                    ret = self._json.loads(response.content, time)
                 except ValueError as e :
+                    if self._retry_policy.is_status_retryable(response.status_code):
+                        raise PostmenException(message='HTTP code = %d' % response.status_code, code = response.status_code, retryable = True)
                     error_message = "Something went wrong on Postmen's end"
                     raise PostmenException(message = error_message, code = 500)
                 meta_code = ret.get('meta', {}).get('code', None)
@@ -188,9 +406,9 @@ class Postmen(object):
                     raise PostmenException(**ret)
                 if 'data' not in ret:
                     raise PostmenException(message='no data returned by API server', **ret)
-                ret = ret['data']
+                ret = response.content if raw == 'bytes' else ret['data']
         else:
-            raise PostmenException(message='no response from API server')
+            raise PostmenException(message='no response from API server', retryable = self._retry_policy.is_status_retryable(response.status_code))
         if not response.ok:
             raise PostmenException(message='HTTP code = %d' % response.status_code)
         return ret
@@ -200,16 +418,18 @@ class Postmen(object):
         body  = kwargs.get('body', {})
         query = kwargs.get('query', {})
         endpoint = kwargs.get('endpoint', self._endpoint)
+        timeout = kwargs.get('timeout', self._timeout)
 
-        headers = self._headers
+        # own copy, compression and middleware may change headers of one request
+        headers = dict(self._headers)
 
         url = six.moves.urllib.parse.urljoin(
             endpoint,
             '%s/%s' % (self._version, path),
             allow_fragments=False
         )
-        if body and not isinstance(body, six.string_types):
-            body = json.dumps(body, cls=JSONWithDatetimeEncoder)
+        if body and not isinstance(body, (six.string_types, bytes)):
+            body = self._json.dumps(body)
         if isinstance(query, dict):
             for key in list(query.keys()):
                 value = query[key]
@@ -225,20 +445,195 @@ class Postmen(object):
             "params":  query,
             "headers": headers,
             "data":    body,
-            "proxies": proxy
+            "proxies": proxy,
+            "timeout": timeout
         }
 
-    def _apply_rate_limit(self):
-        if isinstance(self._calls_left, six.integer_types) and self._calls_left <= 0:
-            # print('self._time_before_reset', self._time_before_reset)
-            # print('int(time_module.time())', int(time_module.time()))
-            delta = self._time_before_reset - int(time_module.time())
-            if delta > 0:
-                if not self._rate:
-                    raise PostmenException(message = 'You have exceeded the API call rate limit. Please retry again at X-RateLimit-Reset header timestamp', code = 429, retryable = True)
-                else :
-                    # print('apply delay', delta)
-                    self._delay(delta)
+    def _compress_params(self, params, **kwargs):
+        # compress request body in place, returns body size before and after compression
+        compress = kwargs.get('compress', self._compress)
+        body = params['data']
+        if not body:
+            return {'request': 0, 'request_uncompressed': 0}
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        size = len(body)
+        if compress and size >= self._compress_threshold:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, _COMPRESS_WBITS[compress])
+            body = compressor.compress(body) + compressor.flush()
+            params['data'] = body
+            params['headers']['content-encoding'] = compress
+        return {'request': len(body), 'request_uncompressed': size}
+
+    def _count_response_bytes(self, counts, response):
+        counts['response'] = _wire_bytes(response)
+        counts['response_decoded'] = len(response.content)
+        self._byte_counts = counts
+
+    def _rate_limit_delay(self, rate=None, deadline_at=None):
+        rate = self._rate if rate is None else rate
+        try:
+            if deadline_at is None:
+                return self._rate_limiter.acquire(block=rate)
+            # a call which would wait past its deadline does not reserve a place in the quota
+            return self._rate_limiter.acquire(block=rate, max_delay=deadline_at - _monotonic())
+        except RateLimitExceeded as e:
+            if rate:
+                self._check_deadline(deadline_at, e.delay)
+            raise PostmenException(message = 'You have exceeded the API call rate limit. Please retry again at X-RateLimit-Reset header timestamp', code = 429, retryable = True)
+
+    def _cache_entry(self, method, path, **kwargs):
+        # cache and key the call may be answered from
+        if kwargs.get('cache', True) is False:
+            return None, None
+        endpoint = kwargs.get('endpoint', self._endpoint)
+        path = path.strip('/')
+        if method == 'GET' and self._cache is not None:
+            query = kwargs.get('query', {})
+            if isinstance(query, dict):
+                query = tuple(sorted((str(key), value.isoformat() if isinstance(value, datetime.datetime) else str(value)) for key, value in query.items()))
+            else:
+                query = tuple(sorted(six.moves.urllib.parse.parse_qsl(query.lstrip('?'), keep_blank_values=True)))
+            return self._cache, (self._account, endpoint, path, query)
+        if method == 'POST' and path == 'rates' and self._rate_cache is not None:
+            try:
+                return self._rate_cache, (self._account, endpoint, path, payload_hash(kwargs.get('body', {})))
+            except (ValueError, TypeError):
+                return None, None
+        return None, None
+
+    def _cached_response(self, method, path, **kwargs):
+        if kwargs.get('cache', True) == 'refresh':
+            return None
+        cache, key = self._cache_entry(method, path, **kwargs)
+        if cache is None:
+            return None
+        return cache.get(key)
+
+    def _cache_response(self, method, path, response, data, **kwargs):
+        resource = path.strip('/').split('/')[0]
+        if method != 'GET' and self._cache is not None:
+            # a successful change makes cached responses of the resource stale, even if it skipped the cache
+            for related in self._related_resources.get(resource, (resource,)):
+                self._cache.invalidate(related)
+        if kwargs.get('cache', True) is False:
+            return
+        cache, key = self._cache_entry(method, path, **kwargs)
+        if cache is None:
+            return
+        if isinstance(data, (six.string_types, bytes)):
+            # raw result, cacheability is decided on the decoded data
+            try:
+                data = self._json.loads(response.content).get('data')
+            except (ValueError, AttributeError):
+                return
+        if not cache.cacheable(data):
+            return
+        response = BufferedResponse(response.status_code, response.headers, response.content, response.encoding)
+        cache.set(key, resource, response)
+
+    def invalidate_cache(self, resource=None):
+        """Drop cached GET responses of resource type (e.g. labels), None to drop all.
+
+        :param resource: resource type
+        :type resource: str or unicode
+        """
+        if self._cache is not None:
+            self._cache.invalidate(resource)
+
+    def _check_deadline(self, deadline_at, wait=0, last_error=None):
+        if deadline_at is None or _monotonic() + wait < deadline_at:
+            return
+        details = [last_error.message()] if last_error is not None else []
+        raise PostmenDeadlineException(message='Call deadline exceeded', details=details)
+
+    def _deadline_timeout(self, timeout, deadline_at):
+        # HTTP timeouts never outlast the call deadline
+        if deadline_at is None:
+            return timeout
+        left = max(deadline_at - _monotonic(), 0.001)
+        if timeout is None:
+            return (left, left)
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return (
+            left if connect is None else min(connect, left),
+            left if read is None else min(read, left)
+        )
+
+    def _apply_rate_limit(self, rate=None, deadline_at=None):
+        delay = self._rate_limit_delay(rate, deadline_at)
+        if delay > 0:
+            # print('apply delay', delay)
+            self._delay(delay)
+        return delay
+
+    def _run_hooks(self, name, context, *args):
+        for middleware in self._middleware:
+            getattr(middleware, name)(context, *args)
+
+    def _transport(self, params):
+        if self._cassette is not None:
+            return self._cassette_transport(params)
+        return self._session.request(**params)
+
+    def _cassette_transport(self, params):
+        cassette = self._cassette
+        if cassette.replaying:
+            response = cassette.replay(params)
+            if response is not None:
+                delay = cassette.delay()
+                if delay > 0:
+                    self._delay(delay)
+                return response
+            if not cassette.recording:
+                raise PostmenException(message='request is not recorded in cassette', details=[request_key(params)])
+        response = self._session.request(**params)
+        cassette.record(params, response)
+        return response
+
+    def _send(self, context, params):
+        if context is None:
+            return self._transport(params)
+        send = self._transport
+        for middleware in reversed(self._middleware):
+            send = _bind_send(middleware, context, send)
+        return send(params)
+
+    def _start_call(self, method, path, kwargs):
+        # returns call context, None when there is no middleware
+        self._byte_counts = None
+        if not self._middleware:
+            return None
+        context = CallContext(method, path, kwargs)
+        kwargs['context'] = context
+        self._run_hooks('before_call', context)
+        return context
+
+    def _call_done(self, context, result):
+        if context is not None:
+            self._run_hooks('after_call', context, result, None)
+        return result
+
+    def _call_failed(self, context, e, safe):
+        if context is not None:
+            self._run_hooks('after_call', context, None, e)
+        return self._report_error(e, safe)
+
+    def _retry_delay(self, e, count, delay, elapsed, **kwargs):
+        retry = kwargs.get('retry', self._retry)
+        rate  = kwargs.get('rate', self._rate)
+        if not retry:
+            return None
+        if not rate and e.code() == 429:
+            # rate = False, rate limit errors are reported instead of waited out
+            return None
+        if isinstance(e, PostmenDeadlineException):
+            return None
+        deadline_at = kwargs.get('deadline_at', None)
+        if deadline_at is None:
+            return self._retry_policy.delay(e, count, delay, elapsed, kwargs.get('tries', None))
+        # a retry past the deadline is given up by call() without taking a retry budget token
+        return self._retry_policy.delay(e, count, delay, elapsed, kwargs.get('tries', None), deadline_at - _monotonic())
 
     def _call_ones(self, method, path, **kwargs):
         retry = kwargs.get('retry', self._retry)
@@ -247,14 +642,42 @@ class Postmen(object):
         time  = kwargs.get('time', self._time)
         proxy = kwargs.get('proxy', self._proxy)
         tries = kwargs.get('tries', self._retries)
+        deadline_at = kwargs.get('deadline_at', None)
+        context = kwargs.get('context', None)
         self._error = None
+        if context is not None:
+            context.attempt += 1
+            self._run_hooks('before_attempt', context)
         params = self._get_requests_params(method, path, **kwargs)
-        self._apply_rate_limit()
+        params['stream'] = kwargs.get('stream', False)
+        counts = self._compress_params(params, **kwargs)
+        if context is not None:
+            self._run_hooks('after_serialize', context, params)
+        delay = self._apply_rate_limit(kwargs.get('rate', self._rate), deadline_at)
+        if context is not None:
+            self._run_hooks('after_rate_limit', context, delay)
+        params['timeout'] = self._deadline_timeout(params['timeout'], deadline_at)
         try:
-            response = requests.request(**params)
+            response = self._send(context, params)
+        except PostmenException:
+            raise
         except Exception as e :
-            raise PostmenException(message = 'Failed to perform HTTP request')
-        return self._response(response, **kwargs)
+            self._check_deadline(deadline_at)
+            retryable = self._retry_policy.is_transport_retryable(method, e)
+            raise PostmenException(message = 'Failed to perform HTTP request', details = [str(e)], retryable = retryable)
+        if context is not None:
+            self._run_hooks('after_response', context, response)
+        if params['stream'] and response.ok:
+            # body is read and parsed by the caller
+            self._rate_limiter.update(response.headers)
+            self._byte_counts = counts
+            return response
+        self._count_response_bytes(counts, response)
+        ret = self._response(response, **kwargs)
+        if context is not None:
+            self._run_hooks('after_parse', context, ret)
+        self._cache_response(method, path, response, ret, **kwargs)
+        return ret
 
     def call(self, method, path, **kwargs):
         """Create, perform HTTP call to Postmen API, parse and return result.
@@ -263,36 +686,69 @@ class Postmen(object):
         :type method: str or unicode
         :param path: URL path
         :type path: str or unicode
-        :param **kwargs: query, body, raw, safe, time, proxy, retry params
+        :param **kwargs: query, body, raw, safe, time, proxy, retry, timeout, deadline params
 
         :returns: API data response
-        :rtype: dict or list or str or unicode
+        :rtype: dict or list or str or unicode or bytes
 
         :raises PostmenException: all errors and exceptions
         """
-        retry  = kwargs.get('retry', self._retry)
         safe  = kwargs.get('safe', self._safe)
-        tries = kwargs.get('tries', self._retries)
+        deadline = kwargs.get('deadline', self._deadline)
         count = 0
         delay = 0
+        start = _monotonic()
+        if deadline is not None:
+            kwargs['deadline_at'] = start + deadline
+        context = self._start_call(method, path, kwargs)
+        try:
+            cached = self._cached_response(method, path, **kwargs)
+            if cached is not None:
+                self._error = None
+                if context is not None:
+                    context.cached = True
+                return self._call_done(context, self._parse_response(cached, **kwargs))
+            self._retry_policy.started()
+        except Exception as e:
+            return self._call_failed(context, e, safe)
         while True:
             try:
-                return self._call_ones(method, path, **kwargs)
+                ret = self._call_ones(method, path, **kwargs)
             except PostmenException as e:
-                if not e.retryable() or not retry:
-                    return self._report_error(e, safe)
                 count = count + 1
-                if count >= tries:
-                    return self._report_error(e, safe)
-                delay = 1.0 if delay == 0 else delay*2
+                if context is not None:
+                    self._run_hooks('after_attempt', context, e)
+                delay = self._retry_delay(e, count, delay, _monotonic() - start, **kwargs)
+                if delay is None:
+                    return self._call_failed(context, e, safe)
+                try:
+                    self._check_deadline(kwargs.get('deadline_at', None), delay, e)
+                except PostmenDeadlineException as deadline_error:
+                    return self._call_failed(context, deadline_error, safe)
+                if context is not None:
+                    self._run_hooks('before_retry', context, e, delay)
                 self._delay(delay)
             except Exception as e:
-                return self._report_error(e, safe)
+                return self._call_failed(context, e, safe)
+            else:
+                if context is not None:
+                    self._run_hooks('after_attempt', context, None)
+                return self._call_done(context, ret)
 
     def getError(self):
-        """If safe == True, return last PostmenException"""
+        """If safe == True, return last PostmenException raised in the calling thread"""
         return self._error
 
+    def getByteCounts(self):
+        """Return sizes of the last HTTP request made in the calling thread, None if there was none.
+
+        :returns: request (body bytes sent), request_uncompressed, response (body bytes received)
+            and response_decoded (body bytes after decompression)
+        :rtype: dict
+        """
+        counts = self._byte_counts
+        return dict(counts) if counts is not None else None
+
     def GET(self, path, **kwargs):
         """Create, perform HTTP GET call to Postmen API, parse and return result.
 
@@ -362,3 +818,280 @@ class Postmen(object):
         """
         kwargs['body'] = payload
         return self.POST(resource, **kwargs)
+
+    def _map(self, func, items, concurrency):
+        def run(item):
+            try:
+                return func(item)
+            except PostmenException as e:
+                return e
+        items = list(items)
+        workers = min(concurrency, len(items))
+        if workers <= 1:
+            return [run(item) for item in items]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, items))
+
+    def create_many(self, resource, payloads, concurrency=4, **kwargs):
+        """Create many resource objects (e.g. labels) running up to concurrency calls at once.
+        Calls share rate limit, retry and other settings of this object. An error of one call does not stop the others.
+
+        :param resource: resource type (e.g. labels)
+        :type resource: str or unicode
+        :param payloads: API call payloads
+        :type payloads: iterable of dict or str or unicode
+        :param concurrency: maximum number of calls in progress, keep it not above pool_maxsize
+        :type concurrency: int
+
+        :returns: results in payloads order, Postmen.call() result or PostmenException for each payload
+        :rtype: list
+        """
+        kwargs['safe'] = False
+        return self._map(lambda payload: self.create(resource, payload, **kwargs), payloads, concurrency)
+
+    def get_many(self, resource, ids, concurrency=4, **kwargs):
+        """Retrieve many resource objects (e.g. labels) by id running up to concurrency calls at once.
+        Calls share rate limit, retry and other settings of this object. An error of one call does not stop the others.
+
+        :param resource: resource type (e.g. labels)
+        :type resource: str or unicode
+        :param ids: resource ids
+        :type ids: iterable of str or unicode
+        :param concurrency: maximum number of calls in progress, keep it not above pool_maxsize
+        :type concurrency: int
+
+        :returns: results in ids order, Postmen.call() result or PostmenException for each id
+        :rtype: list
+        """
+        kwargs['safe'] = False
+        return self._map(lambda id_: self.get(resource, id_, **kwargs), ids, concurrency)
+
+    def _download_ones(self, url, path, chunk_size, **kwargs):
+        proxy = kwargs.get('proxy', self._proxy)
+        deadline_at = kwargs.get('deadline_at', None)
+        timeout = self._deadline_timeout(kwargs.get('timeout', self._timeout), deadline_at)
+        # file URLs are not API calls: no API key and rate limit, identity encoding so Content-Length is the file size
+        try:
+            response = self._session.get(url, stream=True, proxies=proxy, timeout=timeout, headers={'accept-encoding': 'identity'})
+        except Exception as e:
+            self._check_deadline(deadline_at)
+            retryable = self._retry_policy.is_transport_retryable('GET', e)
+            raise PostmenException(message = 'Failed to perform HTTP request', details = [str(e)], retryable = retryable)
+        try:
+            if not response.ok:
+                retryable = self._retry_policy.is_status_retryable(response.status_code)
+                raise PostmenException(message='HTTP code = %d' % response.status_code, code = response.status_code, retryable = retryable)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.%s.' % os.path.basename(path), suffix='.part')
+            try:
+                size = 0
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        self._check_deadline(deadline_at)
+                        f.write(chunk)
+                        size += len(chunk)
+                expected = response.headers.get('content-length', '')
+                if expected.isdigit() and int(expected) != size:
+                    raise PostmenException(message='Incomplete file %s' % url, details=['%d of %s bytes received' % (size, expected)], retryable = True)
+                _replace(tmp, path)
+            except Exception as e:
+                os.remove(tmp)
+                if isinstance(e, PostmenException):
+                    raise
+                self._check_deadline(deadline_at)
+                raise PostmenException(message = 'Failed to perform HTTP request', details = [str(e)], retryable = True)
+        finally:
+            response.close()
+        return path
+
+    def _download_file(self, url, path, chunk_size=64 * 1024, **kwargs):
+        # stream url to path through a temporary file renamed on success, retried and limited by deadline as API calls
+        deadline = kwargs.get('deadline', self._deadline)
+        count = 0
+        delay = 0
+        start = _monotonic()
+        if deadline is not None:
+            kwargs['deadline_at'] = start + deadline
+        while True:
+            try:
+                return self._download_ones(url, path, chunk_size, **kwargs)
+            except PostmenException as e:
+                count = count + 1
+                delay = self._retry_delay(e, count, delay, _monotonic() - start, **kwargs)
+                if delay is None:
+                    raise
+                self._check_deadline(kwargs.get('deadline_at', None), delay, e)
+                self._delay(delay)
+
+    def download_label_files(self, labels, dest_dir, concurrency=4, chunk_size=64 * 1024, **kwargs):
+        """Download label files (files.label.url of label objects) to dest_dir running up to concurrency downloads at once.
+        Files are streamed to disk in chunks, so memory use does not depend on file sizes. A file appears
+        under its final name (label id and file type, e.g. ID.pdf) only when it is complete and its size
+        matches Content-Length. An error of one download does not stop the others.
+
+        :param labels: label objects returned by create() or get(), or label ids to retrieve first
+        :type labels: iterable of dict or str or unicode
+        :param dest_dir: directory to save files to, created if missing
+        :type dest_dir: str or unicode
+        :param concurrency: maximum number of downloads in progress, keep it not above pool_maxsize
+        :type concurrency: int
+        :param chunk_size: bytes read from network at once
+        :type chunk_size: int
+        :param **kwargs: proxy, timeout, deadline, retry and tries params, other params from Postmen.call() apply
+            to label retrieval. deadline limits label retrieval and file download separately, each with its retries
+
+        :returns: results in labels order, path of the file or PostmenException for each label
+        :rtype: list
+        """
+        kwargs.update(safe=False, raw=False)
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+        def download(label):
+            if isinstance(label, six.string_types):
+                label = self.get('labels', label, **kwargs)
+            label_file = (label.get('files') or {}).get('label') or {}
+            if not label_file.get('url'):
+                raise PostmenException(message='label %s has no file' % label.get('id'))
+            path = os.path.join(dest_dir, _label_file_name(label.get('id'), label_file))
+            return self._download_file(label_file['url'], path, chunk_size, **kwargs)
+
+        return self._map(download, labels, concurrency)
+
+    def get_label_file(self, label, **kwargs):
+        """Return label file from label_cache, it is downloaded on first use only.
+
+        :param label: label object, or label id to return the most recently cached file of the label
+            without API call (label is retrieved on cache miss)
+        :type label: dict or str or unicode
+        :param **kwargs: proxy, timeout, deadline, retry and tries params, other params from Postmen.call() apply
+            to label retrieval. deadline limits label retrieval and file download separately, each with its retries
+
+        :returns: read only memory map of the file, bytes-like object to be closed when done
+        :rtype: mmap.mmap
+
+        :raises PostmenException: all errors and exceptions
+        """
+        if self._label_cache is None:
+            raise PostmenException(message='label_cache is not set')
+        kwargs.update(safe=False, raw=False)
+        cache = self._label_cache
+        if isinstance(label, six.string_types):
+            label_id, url = label, None
+        else:
+            label_id, url = label.get('id'), ((label.get('files') or {}).get('label') or {}).get('url')
+        path = cache.find(label_id, url)
+        data = cache.open(path) if path is not None else None
+        if data is not None:
+            return data
+        if url is None:
+            label = self.get('labels', label_id, **kwargs)
+            url = ((label.get('files') or {}).get('label') or {}).get('url')
+            if not url:
+                raise PostmenException(message='label %s has no file' % label_id)
+        path = cache.store(label_id, url, lambda path: self._download_file(url, path, **kwargs))
+        data = cache.open(path)
+        if data is None:
+            raise PostmenException(message='label %s file is empty' % label_id)
+        return data
+
+
+    def iter_resources(self, resource, query=None, key=None, prefetch=1, **kwargs):
+        """Iterate over all resource objects (e.g. labels) page by page, following next_token.
+        Next page is fetched in background while the current one is consumed, so memory use
+        does not depend on the number of pages. AsyncPostmen overrides it with an async generator.
+
+        :param resource: resource type (e.g. labels)
+        :type resource: str or unicode
+        :param query: HTTP GET query of the first page (e.g. limit, created_at_min)
+        :type query: dict
+        :param key: key of objects list in page data, resource with dashes replaced by underscores by default
+        :type key: str or unicode
+        :param prefetch: number of pages fetched ahead of the consumer, 0 to fetch pages on demand
+        :type prefetch: int
+        :param **kwargs: other params from Postmen.call(), safe is ignored
+
+        :returns: generator of resource objects
+        :rtype: generator of dict
+
+        :raises PostmenException: all errors and exceptions
+        """
+        key = key or resource.replace('-', '_')
+        query = dict(query or {})
+        kwargs['safe'] = False
+
+        def pages():
+            page_query = dict(query)
+            while True:
+                page = self.get(resource, query=dict(page_query), **kwargs)
+                yield page
+                next_token = page.get('next_token') if isinstance(page, dict) else None
+                if not next_token:
+                    return
+                page_query['next_token'] = next_token
+
+        source = _prefetch(pages(), prefetch) if prefetch > 0 else pages()
+        for page in source:
+            for item in page.get(key) or []:
+                yield item
+
+    def stream_resources(self, resource, query=None, key=None, chunk_size=64 * 1024, **kwargs):
+        """Iterate over resource objects (e.g. labels) of one list response while it is downloaded.
+        Body is parsed in chunks and each object is yielded as soon as it is complete, so memory use
+        does not depend on the response size. meta.code is checked when it arrives, if it follows
+        the data, errors are raised after the objects were yielded.
+
+        :param resource: resource type (e.g. labels)
+        :type resource: str or unicode
+        :param query: HTTP GET query (e.g. limit, created_at_min)
+        :type query: dict
+        :param key: key of objects list in response data, resource with dashes replaced by underscores by default
+        :type key: str or unicode
+        :param chunk_size: bytes read from network at once
+        :type chunk_size: int
+        :param **kwargs: other params from Postmen.call(), safe, raw and cache are ignored
+
+        :returns: generator of resource objects
+        :rtype: generator of dict
+
+        :raises PostmenException: all errors and exceptions
+        """
+        key = key or resource.replace('-', '_')
+        time = kwargs.get('time', self._time)
+        kwargs.update(safe=False, raw=False, cache=False, stream=True)
+        response = self.call('GET', resource, query=dict(query or {}), **kwargs)
+        parser = JSONArrayStream(('data', key), (('meta',),))
+        meta = None
+        try:
+            chunks = response.iter_content(chunk_size)
+            while True:
+                try:
+                    chunk = next(chunks, None)
+                    found = parser.feed(chunk or b'', chunk is None)
+                except ValueError:
+                    raise PostmenException(message = "Something went wrong on Postmen's end", code = 500)
+                except Exception as e:
+                    raise PostmenException(message = 'Failed to perform HTTP request', details = [str(e)])
+                for kind, path, text in found:
+                    if kind == 'capture':
+                        meta = self._json.loads(text)
+                        meta_code = meta.get('code', None) if isinstance(meta, dict) else None
+                        if not meta_code:
+                            raise PostmenException(message='API response missed meta info')
+                        if int(meta_code) != 200 and int(meta_code / 1000) != 3:
+                            raise PostmenException(meta=meta)
+                    else:
+                        yield self._json.loads(text, time)
+                if chunk is None:
+                    break
+        finally:
+            response.close()
+            counts = self._byte_counts
+            if counts is not None:
+                counts['response'] = _wire_bytes(response)
+                counts['response_decoded'] = parser.bytes_fed
+        if meta is None:
+            raise PostmenException(message='API response missed meta info')
+
+
+if sys.version_info >= (3, 7):
+    from .aio import AsyncPostmen
@@ -0,0 +1,332 @@
+"""AsyncPostmen class is intended for SDK users running inside asyncio event loop (Python 3.7+).
+"""
+
+import asyncio
+import inspect
+import contextvars
+
+from . import Postmen
+from . import PostmenException
+from . import PostmenDeadlineException
+from .buffered import BufferedResponse
+from .cassette import request_key
+from .ratelimit import _monotonic
+from .retry import IDEMPOTENT_METHODS
+
+
+async def _prefetch(iterable, size):
+    """Iterate over async iterable in a background task, keeping up to size items ready ahead of the consumer."""
+    items = asyncio.Queue(maxsize=size)
+    done = object()
+
+    async def produce():
+        try:
+            async for item in iterable:
+                await items.put((item, None))
+            await items.put((done, None))
+        except Exception as e:
+            await items.put((done, e))
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item, error = await items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        task.cancel()
+
+
+class AsyncPostmen(Postmen):
+    """Postmen calls handler for asyncio. Accepts the same arguments as Postmen,
+    call(), GET(), POST(), PUT(), DELETE(), get() and create() are coroutines.
+    Requires aiohttp package (pip install postmen[async]).
+
+    Retry, safe, raw and time options and rate limit handling are shared with Postmen,
+    all coroutines running on one instance share one rate limit state.
+    Last error (safe mode) and byte counts are kept per asyncio task.
+    """
+    def __init__(self, *args, **kwargs):
+        self._error_var = contextvars.ContextVar('postmen_error', default=None)
+        self._byte_counts_var = contextvars.ContextVar('postmen_byte_counts', default=None)
+        super(AsyncPostmen, self).__init__(*args, **kwargs)
+
+    @property
+    def _error(self):
+        return self._error_var.get()
+
+    @_error.setter
+    def _error(self, value):
+        self._error_var.set(value)
+
+    @property
+    def _byte_counts(self):
+        return self._byte_counts_var.get()
+
+    @_byte_counts.setter
+    def _byte_counts(self, value):
+        self._byte_counts_var.set(value)
+
+    def _create_session(self, pool_connections, pool_maxsize, stale_retries):
+        # aiohttp session must be created inside running event loop
+        self._limit = pool_connections * pool_maxsize
+        self._limit_per_host = pool_maxsize
+        self._force_close = self._headers.get('connection') == 'close'
+        return None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            try:
+                import aiohttp
+            except ImportError:
+                raise PostmenException(message='aiohttp package is required by AsyncPostmen')
+            connector = aiohttp.TCPConnector(
+                limit=self._limit,
+                limit_per_host=self._limit_per_host,
+                force_close=self._force_close
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def __enter__(self):
+        raise TypeError('use "async with" with AsyncPostmen')
+
+    async def close(self):
+        """Close all pooled HTTP connections. AsyncPostmen instance may be used as an async context manager instead."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _sleep(self, sec):
+        await asyncio.sleep(sec)
+
+    async def _request(self, params):
+        session = self._get_session()
+        url = params['url']
+        proxies = params['proxies'] or {}
+        proxy = proxies.get(url.split(':', 1)[0])
+        query = params['params']
+        if isinstance(query, str):
+            query = query.lstrip('?')
+        timeout = params.get('timeout', None)
+        if timeout is not None:
+            import aiohttp
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        async with session.request(
+            params['method'], url,
+            params=query or None,
+            headers=params['headers'],
+            data=params['data'] or None,
+            proxy=proxy,
+            timeout=timeout
+        ) as response:
+            content = await response.read()
+            return BufferedResponse(response.status, response.headers, content, response.charset)
+
+    def _is_transport_retryable(self, method, e):
+        try:
+            import aiohttp
+        except ImportError:
+            return self._retry_policy.is_transport_retryable(method, e)
+        if isinstance(e, aiohttp.ClientConnectorError):
+            # connection was not established, request never reached the server
+            return True
+        if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return method.upper() in IDEMPOTENT_METHODS
+        return self._retry_policy.is_transport_retryable(method, e)
+
+    def _transport(self, params):
+        if self._cassette is not None:
+            return self._cassette_transport(params)
+        return self._request(params)
+
+    async def _cassette_transport(self, params):
+        cassette = self._cassette
+        if cassette.replaying:
+            response = cassette.replay(params)
+            if response is not None:
+                delay = cassette.delay()
+                if delay > 0:
+                    await self._sleep(delay)
+                return response
+            if not cassette.recording:
+                raise PostmenException(message='request is not recorded in cassette', details=[request_key(params)])
+        response = await self._request(params)
+        cassette.record(params, response)
+        return response
+
+    async def _call_ones(self, method, path, **kwargs):
+        deadline_at = kwargs.get('deadline_at', None)
+        context = kwargs.get('context', None)
+        self._error = None
+        if context is not None:
+            context.attempt += 1
+            self._run_hooks('before_attempt', context)
+        params = self._get_requests_params(method, path, **kwargs)
+        counts = self._compress_params(params, **kwargs)
+        if context is not None:
+            self._run_hooks('after_serialize', context, params)
+        delay = self._rate_limit_delay(kwargs.get('rate', self._rate), deadline_at)
+        if delay > 0:
+            await self._sleep(delay)
+        if context is not None:
+            self._run_hooks('after_rate_limit', context, delay)
+        params['timeout'] = self._deadline_timeout(params['timeout'], deadline_at)
+        try:
+            response = self._send(context, params)
+            if inspect.isawaitable(response):
+                response = await response
+        except PostmenException:
+            raise
+        except Exception as e:
+            self._check_deadline(deadline_at)
+            retryable = self._is_transport_retryable(method, e)
+            raise PostmenException(message = 'Failed to perform HTTP request', details = [str(e)], retryable = retryable)
+        if context is not None:
+            self._run_hooks('after_response', context, response)
+        self._count_response_bytes(counts, response)
+        ret = self._response(response, **kwargs)
+        if context is not None:
+            self._run_hooks('after_parse', context, ret)
+        self._cache_response(method, path, response, ret, **kwargs)
+        return ret
+
+    async def call(self, method, path, **kwargs):
+        """Coroutine version of Postmen.call()"""
+        safe  = kwargs.get('safe', self._safe)
+        deadline = kwargs.get('deadline', self._deadline)
+        count = 0
+        delay = 0
+        start = _monotonic()
+        if deadline is not None:
+            kwargs['deadline_at'] = start + deadline
+        context = self._start_call(method, path, kwargs)
+        try:
+            cached = self._cached_response(method, path, **kwargs)
+            if cached is not None:
+                self._error = None
+                if context is not None:
+                    context.cached = True
+                return self._call_done(context, self._parse_response(cached, **kwargs))
+            self._retry_policy.started()
+        except Exception as e:
+            return self._call_failed(context, e, safe)
+        while True:
+            try:
+                ret = await self._call_ones(method, path, **kwargs)
+            except PostmenException as e:
+                count = count + 1
+                if context is not None:
+                    self._run_hooks('after_attempt', context, e)
+                delay = self._retry_delay(e, count, delay, _monotonic() - start, **kwargs)
+                if delay is None:
+                    return self._call_failed(context, e, safe)
+                try:
+                    self._check_deadline(kwargs.get('deadline_at', None), delay, e)
+                except PostmenDeadlineException as deadline_error:
+                    return self._call_failed(context, deadline_error, safe)
+                if context is not None:
+                    self._run_hooks('before_retry', context, e, delay)
+                await self._sleep(delay)
+            except Exception as e:
+                return self._call_failed(context, e, safe)
+            else:
+                if context is not None:
+                    self._run_hooks('after_attempt', context, None)
+                return self._call_done(context, ret)
+
+    async def GET(self, path, **kwargs):
+        """Coroutine version of Postmen.GET()"""
+        return await self.call('GET', path, **kwargs)
+
+    async def POST(self, path, **kwargs):
+        """Coroutine version of Postmen.POST()"""
+        return await self.call('POST', path, **kwargs)
+
+    async def PUT(self, path, **kwargs):
+        """Coroutine version of Postmen.PUT()"""
+        return await self.call('PUT', path, **kwargs)
+
+    async def DELETE(self, path, **kwargs):
+        """Coroutine version of Postmen.DELETE()"""
+        return await self.call('DELETE', path, **kwargs)
+
+    async def get(self, resource, id_=None, **kwargs):
+        """Coroutine version of Postmen.get()"""
+        method = '%s/%s' % (resource, str(id_)) if id_ else resource
+        return await self.GET(method, **kwargs)
+
+    async def create(self, resource, payload, **kwargs):
+        """Coroutine version of Postmen.create()"""
+        kwargs['body'] = payload
+        return await self.POST(resource, **kwargs)
+
+    async def _map(self, func, items, concurrency):
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        async def run(item):
+            async with semaphore:
+                try:
+                    return await func(item)
+                except PostmenException as e:
+                    return e
+        return await asyncio.gather(*[run(item) for item in items])
+
+    async def create_many(self, resource, payloads, concurrency=4, **kwargs):
+        """Coroutine version of Postmen.create_many()"""
+        kwargs['safe'] = False
+        return await self._map(lambda payload: self.create(resource, payload, **kwargs), payloads, concurrency)
+
+    async def get_many(self, resource, ids, concurrency=4, **kwargs):
+        """Coroutine version of Postmen.get_many()"""
+        kwargs['safe'] = False
+        return await self._map(lambda id_: self.get(resource, id_, **kwargs), ids, concurrency)
+
+    async def iter_resources(self, resource, query=None, key=None, prefetch=1, **kwargs):
+        """Async generator version of Postmen.iter_resources(), iterate with async for.
+        Next pages are fetched by a background task while the current one is consumed."""
+        key = key or resource.replace('-', '_')
+        query = dict(query or {})
+        kwargs['safe'] = False
+
+        async def pages():
+            page_query = dict(query)
+            while True:
+                page = await self.get(resource, query=dict(page_query), **kwargs)
+                yield page
+                next_token = page.get('next_token') if isinstance(page, dict) else None
+                if not next_token:
+                    return
+                page_query['next_token'] = next_token
+
+        source = _prefetch(pages(), prefetch) if prefetch > 0 else pages()
+        async for page in source:
+            for item in page.get(key) or []:
+                yield item
+
+    def stream_resources(self, *args, **kwargs):
+        """Not available, AsyncPostmen reads every response body whole.
+
+        :raises TypeError: always, use iter_resources() or Postmen.stream_resources()"""
+        raise TypeError('AsyncPostmen does not support stream_resources(), use iter_resources() or Postmen.stream_resources()')
+
+    def download_label_files(self, *args, **kwargs):
+        """Not available, label files are downloaded by the requests session of Postmen.
+
+        :raises TypeError: always, use Postmen.download_label_files()"""
+        raise TypeError('AsyncPostmen does not support download_label_files(), use Postmen.download_label_files()')
+
+    def get_label_file(self, *args, **kwargs):
+        """Not available, label files are downloaded by the requests session of Postmen.
+
+        :raises TypeError: always, use Postmen.get_label_file()"""
+        raise TypeError('AsyncPostmen does not support get_label_file(), use Postmen.get_label_file()')
@@ -0,0 +1,26 @@
+from requests.structures import CaseInsensitiveDict
+
+
+class BufferedResponse(object):
+    """Fully read HTTP response exposing the subset of requests.Response used by Postmen._response()."""
+    def __init__(self, status_code, headers, content, encoding=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding or 'utf-8'
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, 'replace')
+
+    def iter_content(self, chunk_size=1):
+        """Body in chunks, as streamed requests.Response gives it to Postmen.stream_resources()."""
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
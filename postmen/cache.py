@@ -0,0 +1,282 @@
+"""Response caches keep successful API responses, so repeated calls are answered without using the network or rate limit.
+"""
+
+import os
+import re
+import json
+import mmap
+import hashlib
+import datetime
+import threading
+from decimal import Decimal
+from collections import OrderedDict
+
+import six
+
+from .ratelimit import _monotonic
+
+
+class ResponseCache(object):
+    """Cache of API responses with time to live and least recently used eviction bounded by
+    number of entries and total size of response bodies. Safe to share between threads and Postmen objects,
+    Postmen keys responses by API key too.
+
+    :param ttl: seconds a response is served from cache
+    :type ttl: float
+    :param max_entries: maximum number of responses kept
+    :type max_entries: int
+    :param max_bytes: maximum total size of response bodies kept
+    :type max_bytes: int
+    """
+    def __init__(self, ttl=60, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def cacheable(self, data):
+        """:param data: parsed API call data, raw responses are decoded first
+        :returns: True if response with this data may be cached
+        :rtype: bool"""
+        return True
+
+    def get(self, key):
+        """:returns: cached response or None
+        :rtype: postmen.buffered.BufferedResponse"""
+        now = _monotonic()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._bytes -= len(entry[2].content)
+                self._misses += 1
+                return None
+            # re-insert as most recently used
+            self._entries[key] = entry
+            self._hits += 1
+            return entry[2]
+
+    def set(self, key, resource, response):
+        """:param key: cache key
+        :type key: hashable
+        :param resource: resource type the response belongs to (e.g. labels), used by invalidate()
+        :type resource: str or unicode
+        :param response: response to keep
+        :type response: postmen.buffered.BufferedResponse"""
+        size = len(response.content)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[2].content)
+            self._entries[key] = (_monotonic() + self._ttl, resource, response)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self._bytes -= len(entry[2].content)
+
+    def invalidate(self, resource=None):
+        """Drop cached responses of resource type (e.g. labels), None to drop all."""
+        with self._lock:
+            if resource is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [key for key, entry in self._entries.items() if entry[1] == resource]:
+                self._bytes -= len(self._entries.pop(key)[2].content)
+
+    def stats(self):
+        """:returns: hits, misses, entries and bytes counters
+        :rtype: dict"""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+
+def canonical_payload(payload):
+    """Normalize payload so equal requests compare equal: None fields dropped,
+    integral numbers made int, datetime made ISO string.
+
+    :param payload: API call payload, JSON string is parsed first
+    :type payload: dict or list or str or unicode or bytes
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    if isinstance(payload, six.string_types):
+        payload = json.loads(payload)
+    return _canonical(payload)
+
+
+def _canonical(o):
+    if isinstance(o, dict):
+        return dict((six.text_type(key), _canonical(val)) for key, val in o.items() if val is not None)
+    if isinstance(o, (list, tuple)):
+        return [_canonical(val) for val in o]
+    if isinstance(o, bool):
+        return o
+    if isinstance(o, Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, float):
+        return int(o) if o.is_integer() else o
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+    return o
+
+
+def payload_hash(payload):
+    """:returns: hash of canonical payload (sorted keys, no None fields, normalized numbers)
+    :rtype: str"""
+    data = json.dumps(canonical_payload(payload), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class RateQuoteCache(ResponseCache):
+    """Cache of rate quotes (POST /rates) keyed by canonical hash of the shipment payload, identical
+    quotes within ttl are answered without API call. Quotes still being calculated or failed are not cached.
+    Use stats() for hit and miss counters.
+
+    :param ttl: seconds a quote is served from cache
+    :type ttl: float
+    :param max_entries: maximum number of quotes kept
+    :type max_entries: int
+    :param max_bytes: maximum total size of response bodies kept
+    :type max_bytes: int
+    """
+    def __init__(self, ttl=300, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        super(RateQuoteCache, self).__init__(ttl, max_entries, max_bytes)
+
+    def cacheable(self, data):
+        if isinstance(data, dict):
+            return data.get('status') not in ('calculating', 'failed')
+        return True
+
+
+class LabelFileCache(object):
+    """Disk cache of label files keyed by label id and file URL, so reprints are served without download.
+    Each label has a subdirectory holding its files named by URL hash. Files are written to a temporary
+    name and renamed when complete, least recently used files are removed once max_bytes is exceeded.
+    Safe to share between threads, several processes may use one directory.
+
+    :param directory: cache directory, created if missing
+    :type directory: str or unicode
+    :param max_bytes: maximum total size of cached files
+    :type max_bytes: int
+    """
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._bytes = sum(size for _, _, size in self._files())
+
+    def _files(self):
+        for dirpath, _, names in os.walk(self._directory):
+            for name in names:
+                if name.startswith('.'):
+                    # temporary file of a download in progress
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def _label_dir(self, label_id):
+        return os.path.join(self._directory, re.sub(r'[^A-Za-z0-9_.-]', '_', label_id))
+
+    def path(self, label_id, url):
+        """:returns: path of cached file of label and URL, it may not exist
+        :rtype: str or unicode"""
+        ext = os.path.splitext(url.split('?', 1)[0])[1]
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:32] + ext
+        return os.path.join(self._label_dir(label_id), name)
+
+    def find(self, label_id, url=None):
+        """:param url: file URL, None for the most recent file of the label
+        :returns: path of cached file or None
+        :rtype: str or unicode"""
+        if url is not None:
+            path = self.path(label_id, url)
+            return path if os.path.isfile(path) else None
+        label_dir = self._label_dir(label_id)
+        try:
+            names = [name for name in os.listdir(label_dir) if not name.startswith('.')]
+        except OSError:
+            return None
+        paths = [os.path.join(label_dir, name) for name in names]
+        return max(paths, key=os.path.getmtime) if paths else None
+
+    def open(self, path):
+        """Map cached file into memory and mark it recently used.
+
+        :returns: read only memory map of the file (bytes-like, close it when done) or None if file was removed
+        :rtype: mmap.mmap"""
+        try:
+            with open(path, 'rb') as f:
+                os.utime(path, None)
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError):
+            return None
+
+    def store(self, label_id, url, download):
+        """Add file to cache.
+
+        :param download: function writing the file to given path atomically (e.g. Postmen._download_file)
+        :type download: callable
+
+        :returns: path of cached file
+        :rtype: str or unicode"""
+        path = self.path(label_id, url)
+        label_dir = os.path.dirname(path)
+        if not os.path.isdir(label_dir):
+            try:
+                os.makedirs(label_dir)
+            except OSError:
+                # created by another thread or process meanwhile
+                if not os.path.isdir(label_dir):
+                    raise
+        try:
+            # download again replaces the file, it is counted already
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        download(path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - replaced
+            if self._bytes > self._max_bytes:
+                self._evict(path)
+        return path
+
+    def _evict(self, keep):
+        files = sorted(self._files(), key=lambda entry: entry[1])
+        self._bytes = sum(size for _, _, size in files)
+        for path, _, size in files:
+            if self._bytes <= self._max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._bytes -= size
+
+    def stats(self):
+        """:returns: files and bytes counters
+        :rtype: dict"""
+        files = list(self._files())
+        return {'files': len(files), 'bytes': sum(size for _, _, size in files)}
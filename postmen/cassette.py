@@ -0,0 +1,201 @@
+"""Cassette records API responses to a file and replays them later, so calls run offline without
+touching the API or its rate limits.
+"""
+
+import os
+import json
+import gzip
+import zlib
+import base64
+import random
+import hashlib
+import itertools
+import threading
+
+import six
+
+from .cache import payload_hash
+from .buffered import BufferedResponse
+
+MODES = ('replay', 'record', 'auto')
+
+# headers of the original transfer and of API rate limit are not replayed
+_SKIPPED_HEADERS = frozenset([
+    'connection', 'content-encoding', 'content-length', 'date', 'keep-alive', 'set-cookie',
+    'transfer-encoding', 'x-ratelimit-limit', 'x-ratelimit-remaining', 'x-ratelimit-reset'
+])
+
+
+def _query_string(query):
+    if not query:
+        return ''
+    if isinstance(query, six.string_types):
+        pairs = six.moves.urllib.parse.parse_qsl(query.lstrip('?'), keep_blank_values=True)
+    else:
+        pairs = [(six.text_type(key), six.text_type(val)) for key, val in query.items() if val is not None]
+    return six.moves.urllib.parse.urlencode(sorted(pairs))
+
+
+def _body_hash(params):
+    body = params.get('data')
+    if not body:
+        return ''
+    encoding = params.get('headers', {}).get('content-encoding')
+    if encoding:
+        # gzip or zlib header is detected
+        body = zlib.decompress(body, 32 + zlib.MAX_WBITS)
+    try:
+        return payload_hash(body)
+    except ValueError:
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return hashlib.sha256(body).hexdigest()
+
+
+def request_key(params):
+    """:param params: requests.Session.request() params built by Postmen
+    :type params: dict
+
+    :returns: key requests match on: method, URL path, sorted query and hash of canonical body,
+        endpoint host is not part of it
+    :rtype: str"""
+    path = six.moves.urllib.parse.urlparse(params['url']).path
+    query = _query_string(params.get('params'))
+    if query:
+        path = '%s?%s' % (path, query)
+    return '%s %s %s' % (params['method'].upper(), path, _body_hash(params))
+
+
+class Cassette(object):
+    """Gzipped JSON lines file of recorded API responses, one line per response. Postmen(cassette=...) answers
+    calls from it instead of performing HTTP requests. Responses are parsed the same way as API ones.
+    Requests with the same key (see request_key()) are answered by their recorded responses in turn.
+    Safe to share between threads and Postmen objects, close() it to finish the file after recording.
+
+    :param path: cassette file
+    :type path: str or unicode
+    :param mode: replay answers from the file and raises PostmenException for requests not recorded,
+        record performs every request and writes a new file, auto replays recorded requests and
+        records the others, appending to the file
+    :type mode: str or unicode
+    :param latency: seconds every replayed response is delayed by
+    :type latency: float
+    :param jitter: random extra delay of replayed responses up to this many seconds
+    :type jitter: float
+    """
+    def __init__(self, path, mode='replay', latency=0.0, jitter=0.0):
+        if mode not in MODES:
+            raise ValueError('unknown cassette mode %s' % mode)
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._turns = {}
+        self._file = None
+        self._replayed = 0
+        self._recorded = 0
+        self._misses = 0
+        self._random = random.Random()
+        if mode != 'record' and os.path.exists(path):
+            self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def replaying(self):
+        return self.mode != 'record'
+
+    @property
+    def recording(self):
+        return self.mode != 'replay'
+
+    def _load(self):
+        with gzip.open(self.path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    self._add(json.loads(line.decode('utf-8')))
+
+    def _add(self, entry):
+        if 'content_base64' in entry:
+            content = base64.b64decode(entry['content_base64'])
+        else:
+            content = entry['content'].encode('utf-8')
+        # one response object serves every replay, parsing does not change it
+        response = BufferedResponse(entry['status'], entry['headers'], content)
+        key = entry['request']
+        if key not in self._entries:
+            self._entries[key] = []
+            self._turns[key] = itertools.count()
+        self._entries[key].append(response)
+
+    def replay(self, params):
+        """:returns: recorded response to request, None if it is not recorded
+        :rtype: postmen.buffered.BufferedResponse"""
+        key = request_key(params)
+        with self._lock:
+            responses = self._entries.get(key)
+            if responses is None:
+                self._misses += 1
+                return None
+            self._replayed += 1
+            return responses[next(self._turns[key]) % len(responses)]
+
+    def delay(self):
+        """:returns: seconds to delay a replayed response by
+        :rtype: float"""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def record(self, params, response):
+        """Write response to request, it is replayed from now on in auto mode.
+
+        :param params: requests.Session.request() params
+        :type params: dict
+        :param response: API response, its body is read fully
+        :type response: requests.Response or postmen.buffered.BufferedResponse
+        """
+        content = response.content
+        entry = {
+            'request': request_key(params),
+            'status': response.status_code,
+            'headers': dict((key.lower(), val) for key, val in response.headers.items() if key.lower() not in _SKIPPED_HEADERS)
+        }
+        try:
+            entry['content'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['content_base64'] = base64.b64encode(content).decode('ascii')
+        line = json.dumps(entry, sort_keys=True, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = gzip.open(self.path, 'wb' if self.mode == 'record' else 'ab')
+            self._file.write(line.encode('utf-8'))
+            self._recorded += 1
+            if self.mode == 'auto':
+                self._add(entry)
+
+    def close(self):
+        """Finish writing recorded responses."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        """:returns: recorded requests, responses, replayed, recorded and misses counters
+        :rtype: dict"""
+        with self._lock:
+            return {
+                'requests': len(self._entries),
+                'responses': sum(len(responses) for responses in self._entries.values()),
+                'replayed': self._replayed,
+                'recorded': self._recorded,
+                'misses': self._misses
+            }
@@ -0,0 +1,123 @@
+"""JSON backends encode request bodies and decode response bodies, with the same datetime handling
+as JSONWithDatetimeEncoder and JSONWithDatetimeDecoder. Third party backends (orjson, rapidjson, ujson)
+are used only if installed.
+"""
+
+import sys
+import json
+import datetime
+
+import six
+
+from .jsont import JSONWithDatetimeEncoder
+from .jsont import JSONWithDatetimeDecoder
+
+
+def _default(o):
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+
+def _keys(time):
+    return None if time is True else time
+
+
+class StdlibBackend(object):
+    """json module of the standard library."""
+    name = 'stdlib'
+
+    def dumps(self, o):
+        """:returns: JSON document
+        :rtype: str or bytes"""
+        return json.dumps(o, cls=JSONWithDatetimeEncoder)
+
+    def loads(self, data, time=False):
+        """:param data: JSON document
+        :type data: bytes or str or unicode
+        :param time: True to convert ISO time strings to datetime.datetime, list of keys to convert values of these keys only
+        :type time: bool or list
+
+        :raises ValueError: data is not valid JSON"""
+        if not isinstance(data, six.string_types) and sys.version_info < (3, 6):
+            data = data.decode('utf-8')
+        if not time:
+            return json.loads(data)
+        return json.loads(data, cls=JSONWithDatetimeDecoder, keys=_keys(time))
+
+
+class OrjsonBackend(StdlibBackend):
+    """orjson, encodes to bytes. With time set responses are decoded by json module, which converts datetime
+    strings while parsing, a second walk over orjson result is slower than that."""
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, o):
+        return self._orjson.dumps(o, default=_default, option=self._options)
+
+    def loads(self, data, time=False):
+        if time:
+            return StdlibBackend.loads(self, data, time)
+        return self._orjson.loads(data)
+
+
+class RapidjsonBackend(StdlibBackend):
+    """python-rapidjson, converts datetime strings in object_hook like JSONWithDatetimeDecoder."""
+    name = 'rapidjson'
+
+    def __init__(self):
+        import rapidjson
+        self._rapidjson = rapidjson
+
+    def dumps(self, o):
+        return self._rapidjson.dumps(o, default=_default)
+
+    def loads(self, data, time=False):
+        if not time:
+            return self._rapidjson.loads(data)
+        decoder = JSONWithDatetimeDecoder(keys=_keys(time))
+        o = self._rapidjson.loads(data, object_hook=decoder._object_hook)
+        return o if isinstance(o, dict) else decoder.handleObj(o)
+
+
+class UjsonBackend(StdlibBackend):
+    """ujson, with time set responses are decoded by json module as in OrjsonBackend."""
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, o):
+        return self._ujson.dumps(o, default=_default, ensure_ascii=False)
+
+    def loads(self, data, time=False):
+        if time:
+            return StdlibBackend.loads(self, data, time)
+        return self._ujson.loads(data)
+
+
+BACKENDS = [OrjsonBackend, RapidjsonBackend, UjsonBackend, StdlibBackend]
+"""Backends in order of preference for 'auto'."""
+
+
+def get_backend(name='stdlib'):
+    """:param name: stdlib, orjson, rapidjson, ujson or auto for the fastest one installed
+    :type name: str or unicode
+
+    :returns: JSON backend
+    :raises ValueError: unknown backend name
+    :raises ImportError: backend package is not installed"""
+    for kls in BACKENDS:
+        if name == 'auto':
+            try:
+                return kls()
+            except ImportError:
+                continue
+        if kls.name == name:
+            return kls()
+    raise ValueError('unknown JSON backend %s' % name)
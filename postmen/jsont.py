@@ -1,8 +1,70 @@
+import re
 import json
 import datetime
 
 import six
-import dateutil.parser
+import dateutil.tz
+
+_ISO_DATETIME = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:T(\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?'
+    r'(Z|[+-]\d{2}(?::?\d{2})?)?)?\Z'
+)
+_UTC = dateutil.tz.tzutc()
+_TZ_CACHE = {}
+
+
+def _tz(designator):
+    if designator is None:
+        return None
+    if designator == 'Z':
+        return _UTC
+    tz = _TZ_CACHE.get(designator)
+    if tz is None:
+        digits = designator[1:].replace(':', '')
+        offset = int(digits[:2]) * 3600 + int(digits[2:] or 0) * 60
+        if designator[0] == '-':
+            offset = -offset
+        tz = _UTC if offset == 0 else dateutil.tz.tzoffset(None, offset)
+        _TZ_CACHE[designator] = tz
+    return tz
+
+
+def parse_datetime(s):
+    """Convert strict ISO-8601 date or date-time string (e.g. 2016-01-31T16:45:46+00:00) to datetime.datetime.
+
+    :param s: string to convert
+    :type s: str or unicode
+
+    :returns: datetime.datetime or s itself if it is not ISO-8601
+    """
+    # cheap check first, most strings are not dates
+    if len(s) < 10 or s[4] != '-' or s[7] != '-':
+        return s
+    m = _ISO_DATETIME.match(s)
+    if m is None:
+        return s
+    year, month, day, hour, minute, second, fraction, tz = m.groups()
+    try:
+        return datetime.datetime(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0),
+            int(fraction.ljust(6, '0')) if fraction else 0,
+            _tz(tz)
+        )
+    except ValueError:
+        return s
+
+
+def _convert_list(l):
+    c = []
+    for val in l:
+        if isinstance(val, six.string_types):
+            val = parse_datetime(val)
+        elif isinstance(val, list):
+            val = _convert_list(val)
+        c.append(val)
+    return c
 
 
 class JSONWithDatetimeEncoder(json.JSONEncoder):
@@ -13,26 +75,49 @@ class JSONWithDatetimeEncoder(json.JSONEncoder):
 
 
 class JSONWithDatetimeDecoder(json.JSONDecoder):
-    """Parse JSON string as json.JSONDecoder, matched strings convert to datetime.datetime."""
+    """Parse JSON string as json.JSONDecoder, strict ISO-8601 strings convert to datetime.datetime.
+    Conversion is done while parsing, in object_hook.
+
+    :param keys: convert values of these object keys only, None to convert all
+    :type keys: iterable of str or unicode
+    """
+    def __init__(self, *args, **kwargs):
+        keys = kwargs.pop('keys', None)
+        self._keys = frozenset(keys) if keys is not None else None
+        kwargs['object_hook'] = self._object_hook
+        json.JSONDecoder.__init__(self, *args, **kwargs)
+
+    def _object_hook(self, o):
+        keys = self._keys
+        for key, val in list(o.items()):
+            if keys is not None and key not in keys:
+                continue
+            if isinstance(val, six.string_types):
+                o[key] = parse_datetime(val)
+            elif isinstance(val, list):
+                o[key] = _convert_list(val)
+        return o
+
     def decode(self, s):
         o = json.JSONDecoder.decode(self, s)
-        return self.handleObj(o)
+        if self._keys is None:
+            # values outside of any object are not seen by object_hook
+            if isinstance(o, six.string_types):
+                return parse_datetime(o)
+            if isinstance(o, list):
+                return _convert_list(o)
+        return o
 
-    def handleObj(self, o):
+    def handleObj(self, o, convert=None):
+        """Convert ISO-8601 strings in already parsed object, recursively."""
+        if convert is None:
+            convert = self._keys is None
         if isinstance(o, dict):
-            keys = list(o.keys())
-            for key in keys:
-                val = o[key]
-                o[key] = self.handleObj(val)
+            for key, val in list(o.items()):
+                o[key] = self.handleObj(val, self._keys is None or key in self._keys)
             return o
         if isinstance(o, list):
-            c = []
-            for val in o:
-                c.append(self.handleObj(val))
-            return c
-        if isinstance(o, six.string_types):
-            try:
-                return dateutil.parser.parse(o)
-            except:
-                pass
-        return o
\ No newline at end of file
+            return [self.handleObj(val, convert) for val in o]
+        if convert and isinstance(o, six.string_types):
+            return parse_datetime(o)
+        return o
@@ -0,0 +1,183 @@
+"""Metrics middleware counts calls, errors, retries, waits and bytes per method and resource type,
+and keeps call latency histograms. Read them with snapshot() or prometheus().
+"""
+
+import bisect
+import threading
+
+from .ratelimit import _monotonic
+from .middleware import Middleware
+
+DEFAULT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+"""Upper bounds of call latency histogram buckets, seconds."""
+
+
+class _Series(object):
+    def __init__(self, buckets):
+        self.calls = 0
+        self.cached = 0
+        self.errors = {}
+        self.retries = 0
+        self.rate_limit_wait = 0.0
+        self.retry_wait = 0.0
+        self.network_time = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.latency_sum = 0.0
+
+
+class Metrics(Middleware):
+    """Low overhead call metrics, one instance may be shared by many Postmen objects and threads.
+    Per call values are collected in the call context and added to the totals once, when the call ends.
+
+    Example::
+
+        metrics = Metrics()
+        api = Postmen(api_key, region, middleware=[metrics])
+        ...
+        print(metrics.prometheus())
+
+    :param buckets: upper bounds of latency histogram buckets, seconds
+    :type buckets: tuple of float
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def before_call(self, context):
+        context.data[self] = {
+            'rate_limit_wait': 0.0, 'retry_wait': 0.0, 'network_time': 0.0,
+            'request_bytes': 0, 'response_bytes': 0, 'sent_at': None
+        }
+
+    def after_serialize(self, context, params):
+        data = params.get('data')
+        if data:
+            context.data[self]['request_bytes'] += len(data if isinstance(data, bytes) else data.encode('utf-8'))
+
+    def after_rate_limit(self, context, delay):
+        m = context.data[self]
+        m['rate_limit_wait'] += delay
+        m['sent_at'] = _monotonic()
+
+    def after_response(self, context, response):
+        m = context.data[self]
+        if m['sent_at'] is not None:
+            m['network_time'] += _monotonic() - m['sent_at']
+            m['sent_at'] = None
+        length = response.headers.get('content-length', '')
+        if length.isdigit():
+            m['response_bytes'] += int(length)
+        elif not context.kwargs.get('stream', False):
+            # streamed body is not read yet
+            m['response_bytes'] += len(response.content)
+
+    def after_attempt(self, context, error):
+        m = context.data[self]
+        if m['sent_at'] is not None:
+            # transport error, no response
+            m['network_time'] += _monotonic() - m['sent_at']
+            m['sent_at'] = None
+
+    def before_retry(self, context, error, delay):
+        context.data[self]['retry_wait'] += delay
+
+    def after_call(self, context, result, error):
+        m = context.data[self]
+        latency = _monotonic() - context.start
+        bucket = bisect.bisect_left(self._buckets, latency)
+        key = (context.method.upper(), context.resource)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self._buckets)
+            series.calls += 1
+            if context.cached:
+                series.cached += 1
+            if error is not None:
+                code = error.code() if hasattr(error, 'code') else None
+                series.errors[code] = series.errors.get(code, 0) + 1
+            series.retries += max(context.attempt - 1, 0)
+            series.rate_limit_wait += m['rate_limit_wait']
+            series.retry_wait += m['retry_wait']
+            series.network_time += m['network_time']
+            series.request_bytes += m['request_bytes']
+            series.response_bytes += m['response_bytes']
+            series.bucket_counts[bucket] += 1
+            series.latency_sum += latency
+
+    def snapshot(self):
+        """:returns: metrics by 'METHOD resource' (e.g. 'POST labels'): calls, cached, errors by code, retries,
+            rate_limit_wait, retry_wait and network_time seconds, request_bytes, response_bytes and latency
+            histogram with cumulative counts of calls not slower than each bucket bound
+        :rtype: dict"""
+        ret = {}
+        with self._lock:
+            for (method, resource), series in self._series.items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(self._buckets + (float('inf'),), series.bucket_counts):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                ret['%s %s' % (method, resource)] = {
+                    'calls': series.calls,
+                    'cached': series.cached,
+                    'errors': dict(series.errors),
+                    'retries': series.retries,
+                    'rate_limit_wait': series.rate_limit_wait,
+                    'retry_wait': series.retry_wait,
+                    'network_time': series.network_time,
+                    'request_bytes': series.request_bytes,
+                    'response_bytes': series.response_bytes,
+                    'latency': {'buckets': buckets, 'sum': series.latency_sum, 'count': series.calls}
+                }
+        return ret
+
+    def prometheus(self, prefix='postmen'):
+        """:param prefix: metric name prefix
+        :returns: metrics in Prometheus text exposition format
+        :rtype: str"""
+        counters = [
+            ('calls_total', 'API calls', 'calls'),
+            ('cached_calls_total', 'API calls answered from response cache', 'cached'),
+            ('retries_total', 'Retried attempts', 'retries'),
+            ('rate_limit_wait_seconds_total', 'Time waited for rate limit', 'rate_limit_wait'),
+            ('retry_wait_seconds_total', 'Time waited between retries', 'retry_wait'),
+            ('network_seconds_total', 'Time spent in HTTP requests', 'network_time'),
+            ('request_bytes_total', 'Request body bytes sent', 'request_bytes'),
+            ('response_bytes_total', 'Response body bytes received', 'response_bytes')
+        ]
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def labels(key, **extra):
+            method, resource = key.split(' ', 1)
+            pairs = [('method', method), ('resource', resource)] + sorted(extra.items())
+            return '{%s}' % ','.join('%s="%s"' % (name, value) for name, value in pairs)
+
+        for name, help_text, field in counters:
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+            lines.append('# TYPE %s_%s counter' % (prefix, name))
+            for key, values in snapshot:
+                lines.append('%s_%s%s %s' % (prefix, name, labels(key), _number(values[field])))
+        lines.append('# HELP %s_errors_total Failed API calls by error code' % prefix)
+        lines.append('# TYPE %s_errors_total counter' % prefix)
+        for key, values in snapshot:
+            for code, count in sorted(values['errors'].items(), key=lambda item: str(item[0])):
+                lines.append('%s_errors_total%s %d' % (prefix, labels(key, code=code), count))
+        lines.append('# HELP %s_call_duration_seconds API call latency including retries and waits' % prefix)
+        lines.append('# TYPE %s_call_duration_seconds histogram' % prefix)
+        for key, values in snapshot:
+            latency = values['latency']
+            for bound, count in latency['buckets']:
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append('%s_call_duration_seconds_bucket%s %d' % (prefix, labels(key, le=le), count))
+            lines.append('%s_call_duration_seconds_sum%s %s' % (prefix, labels(key), _number(latency['sum'])))
+            lines.append('%s_call_duration_seconds_count%s %d' % (prefix, labels(key), latency['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
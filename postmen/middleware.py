@@ -0,0 +1,87 @@
+"""Middleware adds behaviour around Postmen API calls (metrics, tracing, recording, fault injection)
+without subclassing Postmen. Hooks run only for objects created with middleware, calls without it
+do not pay for them.
+"""
+
+from .ratelimit import _monotonic
+
+
+class CallContext(object):
+    """State of one Postmen.call() passed to every hook.
+
+    :ivar method: HTTP method
+    :ivar path: URL path
+    :ivar resource: resource type (first path segment, e.g. labels)
+    :ivar kwargs: call params
+    :ivar attempt: number of the current attempt, starting from 1
+    :ivar start: monotonic time the call started
+    :ivar cached: True if the call was answered from response cache
+    :ivar data: dict for middleware to keep its own per call state, keyed by the middleware object
+    """
+    def __init__(self, method, path, kwargs):
+        self.method = method
+        self.path = path
+        self.resource = path.strip('/').split('/')[0]
+        self.kwargs = kwargs
+        self.attempt = 0
+        self.start = _monotonic()
+        self.cached = False
+        self.data = {}
+
+
+class Middleware(object):
+    """Base class of middleware, override the hooks needed. Hooks of all middleware objects run in
+    Postmen(middleware=[...]) order, the first middleware send() is the outermost one.
+
+    Hooks of one call run in this order: before_call, then for each attempt before_attempt,
+    after_serialize, after_rate_limit, send, after_response, after_parse, after_attempt and
+    before_retry if the attempt is retried, finally after_call.
+    """
+    def before_call(self, context):
+        """Call started, before response cache lookup.
+
+        :type context: CallContext"""
+
+    def before_attempt(self, context):
+        """HTTP request is about to be built, context.attempt is already incremented."""
+
+    def after_serialize(self, context, params):
+        """Request is built.
+
+        :param params: requests.Session.request() params (method, url, params, headers, data, ...),
+            may be modified, headers dict is a copy made for this request
+        :type params: dict"""
+
+    def after_rate_limit(self, context, delay):
+        """Rate limit wait is over.
+
+        :param delay: seconds waited
+        :type delay: float"""
+
+    def send(self, context, params, send):
+        """Perform HTTP request by calling send(params), or return a response without calling it.
+        For AsyncPostmen send() returns an awaitable, send may return either an awaitable or a response.
+
+        :param send: next middleware send or the transport
+        :type send: callable
+
+        :returns: requests.Response or object with the same status_code, headers, content, text and ok"""
+        return send(params)
+
+    def after_response(self, context, response):
+        """HTTP response is received, before it is parsed."""
+
+    def after_parse(self, context, result):
+        """Response is parsed, result is what call() returns."""
+
+    def after_attempt(self, context, error):
+        """Attempt is done.
+
+        :param error: attempt error, None if it succeeded
+        :type error: PostmenException"""
+
+    def before_retry(self, context, error, delay):
+        """Failed attempt is retried after delay seconds."""
+
+    def after_call(self, context, result, error):
+        """Call is done, error is None if it succeeded. Runs before the error is raised or kept for getError()."""
@@ -0,0 +1,270 @@
+"""Rate limiters track Postmen API quota reported by x-ratelimit-* response headers
+and tell Postmen how long to wait before the next call.
+"""
+
+import os
+import time
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class RateLimitExceeded(Exception):
+    """Raised by RateLimiter.acquire(block=False) when the quota is used up, or when the wait is max_delay or longer,
+    carries seconds left to wait."""
+    def __init__(self, delay):
+        super(RateLimitExceeded, self).__init__(delay)
+        self.delay = delay
+
+
+def _exceeds(delay, max_delay):
+    return max_delay is not None and delay >= max_delay
+
+
+def _header_int(headers, name):
+    value = headers.get(name, None)
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+class RateLimiter(object):
+    """Send calls as fast as possible, once the quota is used up wait until x-ratelimit-reset time.
+    Safe to share between threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls_left = None
+        self._time_before_reset = None
+
+    def update(self, headers):
+        """Update quota from API response headers.
+
+        :param headers: HTTP response headers
+        :type headers: case insensitive dict
+        """
+        sec_before_reset = (_header_int(headers, 'x-ratelimit-reset') or 0) / 1000
+        calls_left = _header_int(headers, 'x-ratelimit-remaining')
+        with self._lock:
+            if sec_before_reset:
+                if not self._time_before_reset or self._time_before_reset < sec_before_reset:
+                    self._time_before_reset = int(sec_before_reset)
+            if calls_left is not None:
+                self._calls_left = calls_left
+
+    def calls_left(self):
+        """:returns: number of calls left in current window, None if unknown
+        :rtype: int or None"""
+        return self._calls_left
+
+    def acquire(self, block=True, max_delay=None):
+        """Reserve one call.
+
+        :param block: False to raise RateLimitExceeded instead of returning a delay when quota is used up
+        :type block: bool
+        :param max_delay: raise RateLimitExceeded without reserving the call if it would wait this many seconds
+            or longer (e.g. past the call deadline), None for no limit
+        :type max_delay: float
+
+        :returns: seconds to wait before the call is sent
+        :rtype: float
+        """
+        with self._lock:
+            if self._calls_left is None:
+                delta = 0
+            elif self._calls_left > 0:
+                if _exceeds(0, max_delay):
+                    raise RateLimitExceeded(0)
+                # reserve the call so concurrent callers do not overrun the quota
+                self._calls_left -= 1
+                return 0
+            elif self._time_before_reset is None:
+                delta = 0
+            else:
+                delta = max(self._time_before_reset - int(time.time()), 0)
+        if delta > 0 and not block or _exceeds(delta, max_delay):
+            raise RateLimitExceeded(delta)
+        return delta
+
+
+class PacingRateLimiter(RateLimiter):
+    """Spread calls evenly over the rate limit window instead of sending a burst and waiting for reset.
+
+    Token bucket refilled at remaining / (reset - now) calls per second on a monotonic clock,
+    up to burst calls may be sent back to back. Safe to share between threads.
+
+    :param burst: bucket size
+    :type burst: int
+    """
+    def __init__(self, burst=1):
+        super(PacingRateLimiter, self).__init__()
+        self._burst = max(burst, 1)
+        self._limit = None
+        self._reset_at = None
+        self._window = None
+        self._tat = None
+
+    def _now(self):
+        return _monotonic()
+
+    def update(self, headers):
+        limit = _header_int(headers, 'x-ratelimit-limit')
+        calls_left = _header_int(headers, 'x-ratelimit-remaining')
+        reset = _header_int(headers, 'x-ratelimit-reset')
+        now = self._now()
+        with self._lock:
+            if limit is not None:
+                self._limit = limit
+            if calls_left is not None:
+                self._calls_left = calls_left
+            if reset:
+                # x-ratelimit-reset is a wall clock timestamp in milliseconds
+                window = reset / 1000.0 - time.time()
+                self._reset_at = now + window
+                if window > 0 and (self._window is None or window > self._window):
+                    self._window = window
+
+    def acquire(self, block=True, max_delay=None):
+        now = self._now()
+        with self._lock:
+            unknown = self._calls_left is None or self._reset_at is None
+            if unknown or self._reset_at <= now and not (self._limit and self._window):
+                if _exceeds(0, max_delay):
+                    raise RateLimitExceeded(0)
+                return 0
+            if self._reset_at <= now:
+                # window passed without a fresh response, assume full quota
+                self._calls_left = self._limit
+                self._reset_at = now + self._window
+            if self._calls_left <= 0:
+                delay = self._reset_at - now
+                if not block or _exceeds(delay, max_delay):
+                    raise RateLimitExceeded(delay)
+                self._tat = self._reset_at
+                return delay
+            if not block:
+                if _exceeds(0, max_delay):
+                    raise RateLimitExceeded(0)
+                self._calls_left -= 1
+                return 0
+            # theoretical arrival time of this call, remaining quota is spread over what is left of the window
+            tat = now if self._tat is None or self._tat < now else self._tat
+            interval = max(self._reset_at - tat, 0) / self._calls_left
+            delay = max(tat - (self._burst - 1) * interval - now, 0)
+            # nothing is reserved for a call that would not be sent
+            if _exceeds(delay, max_delay):
+                raise RateLimitExceeded(delay)
+            self._tat = tat + interval
+            self._calls_left -= 1
+            return delay
+
+
+class _FileLock(object):
+    """Exclusive lock of SharedRateLimiter state file, loads the state on enter and stores it on exit."""
+    def __init__(self, limiter):
+        self._limiter = limiter
+        # flock does not exclude threads sharing one file descriptor
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._fd = self._limiter._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except:
+            self._thread_lock.release()
+            raise
+        try:
+            self._limiter._load(self._fd)
+        except:
+            self._release()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self._limiter._store(self._fd)
+        finally:
+            self._release()
+
+    def _release(self):
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+
+class SharedRateLimiter(PacingRateLimiter):
+    """PacingRateLimiter whose state is kept in a file shared by all processes on one host using the same API key,
+    so worker processes split one quota instead of each spending all of it. Every acquire() and update() holds
+    an exclusive flock on the file, time is taken from the wall clock which, unlike the monotonic one, all processes agree on.
+    POSIX only.
+
+    :param path: state file path, the same for all processes sharing the quota
+    :type path: str or unicode
+    :param burst: bucket size, use quota size to send calls in bursts and only wait once the quota is used up
+    :type burst: int
+
+    :raises OSError: on platforms without fcntl module (not POSIX)
+    """
+    _format = struct.Struct('<qqddd')
+
+    def __init__(self, path, burst=1):
+        if fcntl is None:
+            raise OSError('SharedRateLimiter is POSIX only, fcntl module is not available')
+        super(SharedRateLimiter, self).__init__(burst=burst)
+        self._path = path
+        self._fd = None
+        self._pid = None
+        self._lock = _FileLock(self)
+
+    def _now(self):
+        return time.time()
+
+    def _open(self):
+        # descriptor inherited through fork() shares the lock with the parent, open a new one in each process
+        pid = os.getpid()
+        if self._fd is None or self._pid != pid:
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = pid
+        return self._fd
+
+    def _load(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = os.read(fd, self._format.size)
+        if len(data) < self._format.size:
+            calls_left, limit, reset_at, window, tat = -1, -1, 0.0, 0.0, 0.0
+        else:
+            calls_left, limit, reset_at, window, tat = self._format.unpack(data)
+        self._calls_left = None if calls_left < 0 else calls_left
+        self._limit = None if limit < 0 else limit
+        self._reset_at = reset_at or None
+        self._window = window or None
+        self._tat = tat or None
+
+    def _store(self, fd):
+        data = self._format.pack(
+            -1 if self._calls_left is None else max(self._calls_left, 0),
+            -1 if self._limit is None else self._limit,
+            self._reset_at or 0.0,
+            self._window or 0.0,
+            self._tat or 0.0
+        )
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, data)
+
+    def calls_left(self):
+        with self._lock:
+            return self._calls_left
+
+    def close(self):
+        """Close the state file descriptor."""
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
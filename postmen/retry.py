@@ -0,0 +1,149 @@
+"""Retry policies decide whether and when a failed Postmen API call is attempted again.
+"""
+
+import random
+import threading
+
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+from .ratelimit import _monotonic
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class RetryBudget(object):
+    """Cap retries to a share of calls, so retries can not multiply the load during an outage.
+    Every call deposits ratio of a token, every retry takes one token. On top of that the bucket
+    is refilled with min_per_second tokens per second. Safe to share between threads.
+
+    :param ratio: retries allowed per call
+    :type ratio: float
+    :param min_per_second: retries always allowed per second
+    :type min_per_second: float
+    :param capacity: maximum number of saved up tokens
+    :type capacity: float
+    """
+    def __init__(self, ratio=0.2, min_per_second=10, capacity=100):
+        self._lock = threading.Lock()
+        self._ratio = ratio
+        self._min_per_second = min_per_second
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = _monotonic()
+
+    def _refill(self, tokens):
+        now = _monotonic()
+        self._tokens = min(self._capacity, self._tokens + tokens + (now - self._updated) * self._min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        """Record a call."""
+        with self._lock:
+            self._refill(self._ratio)
+
+    def withdraw(self):
+        """Take a token for a retry.
+
+        :returns: False if budget is exhausted and retry must not be done
+        :rtype: bool"""
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+default_budget = RetryBudget()
+"""Retry budget shared by all Postmen objects of the process using the default RetryPolicy."""
+
+
+class RetryPolicy(object):
+    """Retry retryable errors with decorrelated jitter backoff: each delay is random between base and three
+    times the previous delay, capped by cap, so clients do not retry in lockstep.
+
+    :param tries: maximum number of attempts (per call tries argument overwrites it)
+    :type tries: int
+    :param base: minimal delay, seconds
+    :type base: float
+    :param cap: maximal delay, seconds
+    :type cap: float
+    :param max_elapsed: total time budget of one call including all attempts and delays, seconds, None for no limit
+    :type max_elapsed: float
+    :param budget: retry budget, None to disable
+    :type budget: RetryBudget
+    :param statuses: HTTP status codes retried when response has no API error info
+    :type statuses: set of int
+    """
+    def __init__(self, tries=5, base=1.0, cap=20.0, max_elapsed=None, budget=default_budget, statuses=(429, 502, 503, 504)):
+        self.tries = tries
+        self.base = base
+        self.cap = cap
+        self.max_elapsed = max_elapsed
+        self.budget = budget
+        self.statuses = frozenset(statuses)
+
+    def started(self):
+        """Called once per call before the first attempt."""
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def is_retryable(self, e):
+        """:param e: attempt error
+        :type e: PostmenException
+        :rtype: bool"""
+        return e.retryable()
+
+    def is_status_retryable(self, status_code):
+        """:returns: True if HTTP response without API error info can be retried
+        :rtype: bool"""
+        return status_code in self.statuses
+
+    def is_transport_retryable(self, method, e):
+        """:param method: HTTP method
+        :type method: str or unicode
+        :param e: exception raised by requests
+        :type e: Exception
+
+        :returns: True if failed HTTP request can be sent again. Request which may have reached the server
+            is retried for idempotent methods only, so POST never creates a resource twice
+        :rtype: bool"""
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(e, requests.exceptions.ConnectionError):
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            if isinstance(reason, NewConnectionError):
+                return True
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return method.upper() in IDEMPOTENT_METHODS
+        return False
+
+    def delay(self, e, count, previous, elapsed, tries=None, max_delay=None):
+        """:param e: error of the last attempt
+        :type e: PostmenException
+        :param count: number of attempts done
+        :type count: int
+        :param previous: previous delay, 0 if none
+        :type previous: float
+        :param elapsed: seconds since the call started
+        :type elapsed: float
+        :param tries: maximum number of attempts, None for policy default
+        :type tries: int
+        :param max_delay: seconds left before the call deadline, None for no deadline. Delays of max_delay
+            or longer are returned without taking a retry budget token, the caller gives the call up
+        :type max_delay: float
+
+        :returns: seconds to wait before next attempt, None to give up
+        :rtype: float or None"""
+        tries = self.tries if tries is None else tries
+        if not self.is_retryable(e) or count >= tries:
+            return None
+        delay = min(self.cap, random.uniform(self.base, max(previous, self.base) * 3))
+        if self.max_elapsed is not None and elapsed + delay > self.max_elapsed:
+            return None
+        if max_delay is not None and delay >= max_delay:
+            return delay
+        if self.budget is not None and not self.budget.withdraw():
+            return None
+        return delay
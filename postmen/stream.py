@@ -0,0 +1,155 @@
+"""Incremental JSON parsing of response bodies received in chunks. Values are sliced out of the
+document as soon as they are complete, so memory use depends on the size of one value, not of the document.
+"""
+
+import re
+import json
+import codecs
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR = re.compile(r'[^,:\]}\s]+')
+
+
+class IncompleteJSON(ValueError):
+    """Document ended before all its values were closed."""
+
+
+class JSONArrayStream(object):
+    """Find values at given paths in a JSON document fed chunk by chunk.
+
+    :param items_path: path of the array to yield elements of, e.g. ('data', 'labels')
+    :type items_path: tuple
+    :param capture_paths: paths of other values to return whole, e.g. (('meta',),)
+    :type capture_paths: tuple
+    """
+    def __init__(self, items_path, capture_paths=()):
+        self._items_path = tuple(items_path)
+        self._capture_paths = set(tuple(path) for path in capture_paths)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        # frames of open containers: [is_object, key or index, expecting_key]
+        self._stack = []
+        self._capture = None
+        self._finished = False
+        self.bytes_fed = 0
+
+    def _path(self):
+        return tuple(frame[1] for frame in self._stack)
+
+    def _wanted(self, path):
+        if path in self._capture_paths:
+            return 'capture'
+        if not self._stack[-1][0] and path[:-1] == self._items_path:
+            return 'item'
+        return None
+
+    def feed(self, chunk, final=False):
+        """Parse next chunk.
+
+        :param chunk: next part of the document
+        :type chunk: bytes
+        :param final: True for the last chunk
+
+        :returns: (kind, path, text) of each value completed by the chunk, kind is item or capture
+        :rtype: list
+        :raises ValueError: document is not valid JSON
+        """
+        self.bytes_fed += len(chunk)
+        self._buf += self._decoder.decode(chunk, final)
+        found = []
+        self._scan(found, final)
+        if final and not self._finished:
+            raise IncompleteJSON('unexpected end of JSON document')
+        # drop what was parsed, keep captured value being read
+        keep = self._pos if self._capture is None else self._capture[0]
+        if keep:
+            self._buf = self._buf[keep:]
+            self._pos -= keep
+            if self._capture is not None:
+                self._capture = (0,) + self._capture[1:]
+        return found
+
+    def _begin(self, start):
+        if self._capture is not None or not self._stack:
+            return
+        frame = self._stack[-1]
+        if frame[0] and frame[2]:
+            return
+        path = self._path()
+        kind = self._wanted(path)
+        if kind is not None:
+            self._capture = (start, len(self._stack), kind, path)
+
+    def _end(self, found, end):
+        if self._stack:
+            frame = self._stack[-1]
+            if frame[0]:
+                frame[2] = False
+        else:
+            self._finished = True
+        if self._capture is not None and self._capture[1] == len(self._stack):
+            start, _, kind, path = self._capture
+            found.append((kind, path, self._buf[start:end]))
+            self._capture = None
+
+    def _scan(self, found, final):
+        buf = self._buf
+        while True:
+            pos = _WHITESPACE.match(buf, self._pos).end()
+            self._pos = pos
+            if pos >= len(buf):
+                return
+            if self._finished:
+                raise ValueError('extra data after JSON document')
+            c = buf[pos]
+            if c == '{' or c == '[':
+                self._begin(pos)
+                self._stack.append([c == '{', None if c == '{' else 0, c == '{'])
+                self._pos = pos + 1
+            elif c == '}' or c == ']':
+                if not self._stack or self._stack[-1][0] != (c == '}'):
+                    raise ValueError('unexpected %s at %d' % (c, pos))
+                self._stack.pop()
+                self._pos = pos + 1
+                self._end(found, pos + 1)
+            elif c == '"':
+                m = _STRING_END.match(buf, pos + 1)
+                if m is None:
+                    return
+                end = m.end()
+                frame = self._stack[-1] if self._stack else None
+                if frame is not None and frame[0] and frame[2]:
+                    key = buf[pos + 1:end - 1]
+                    frame[1] = json.loads(buf[pos:end]) if '\\' in key else key
+                else:
+                    self._begin(pos)
+                    self._end(found, end)
+                self._pos = end
+            elif c == ':':
+                frame = self._stack[-1] if self._stack else None
+                if frame is None or not frame[0] or not frame[2]:
+                    raise ValueError('unexpected : at %d' % pos)
+                frame[2] = False
+                self._pos = pos + 1
+            elif c == ',':
+                frame = self._stack[-1] if self._stack else None
+                if frame is None:
+                    raise ValueError('unexpected , at %d' % pos)
+                if frame[0]:
+                    frame[2] = True
+                else:
+                    frame[1] += 1
+                self._pos = pos + 1
+            else:
+                m = _SCALAR.match(buf, pos)
+                if m is None:
+                    raise ValueError('unexpected %s at %d' % (c, pos))
+                end = m.end()
+                if end >= len(buf) and not final:
+                    # number may continue in the next chunk
+                    return
+                self._begin(pos)
+                self._end(found, end)
+                self._pos = end
@@ -0,0 +1,103 @@
+"""Payload templates serialize the constant part of a request body once, so calls sending many
+similar payloads (e.g. labels of one shipper) encode only the fields that change.
+"""
+
+import json
+
+from .jsont import JSONWithDatetimeEncoder
+
+
+def _dumps(o):
+    return json.dumps(o, cls=JSONWithDatetimeEncoder, separators=(',', ':'))
+
+
+def _drop_none(o):
+    if isinstance(o, dict):
+        return dict((key, _drop_none(val)) for key, val in o.items() if val is not None)
+    if isinstance(o, (list, tuple)):
+        return [_drop_none(val) for val in o]
+    return o
+
+
+class Var(object):
+    """Placeholder of a value set when PayloadTemplate is rendered.
+
+    :param name: name of render() keyword argument holding the value
+    :type name: str
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'Var(%r)' % self.name
+
+
+class PayloadTemplate(object):
+    """Request body with constant fields pre-serialized to compact JSON and Var placeholders
+    for fields set per call. None fields are dropped, a Var object field set to None is dropped too.
+
+    Example::
+
+        template = PayloadTemplate({'shipper_account': {'id': shipper}, 'shipment': {
+            'ship_from': sender, 'ship_to': Var('receiver'), 'parcels': Var('parcels')}})
+        api.create('labels', template.render(receiver=receiver, parcels=parcels))
+
+    :param payload: API call payload, Var objects may be placed in place of any value
+    :type payload: dict
+    """
+    def __init__(self, payload):
+        self._node = self._compile(payload)
+
+    def _compile(self, o):
+        # a node is JSON text or a tuple of kind and parts, for values containing Var objects
+        if isinstance(o, Var):
+            return ('var', o.name)
+        if isinstance(o, dict):
+            parts = []
+            for key, val in o.items():
+                if val is None:
+                    continue
+                node = self._compile(val)
+                member = _dumps(key) + ':'
+                if isinstance(node, str):
+                    if parts and isinstance(parts[-1], str):
+                        parts[-1] += ',' + member + node
+                    else:
+                        parts.append(member + node)
+                else:
+                    parts.append((member, node))
+            if all(isinstance(part, str) for part in parts):
+                return '{%s}' % ','.join(parts)
+            return ('obj', parts)
+        if isinstance(o, (list, tuple)):
+            nodes = [self._compile(val) for val in o]
+            if all(isinstance(node, str) for node in nodes):
+                return '[%s]' % ','.join(nodes)
+            return ('arr', nodes)
+        return _dumps(o)
+
+    def _render(self, node, values):
+        if isinstance(node, str):
+            return node
+        kind, parts = node
+        if kind == 'var':
+            return _dumps(_drop_none(values[parts]))
+        if kind == 'arr':
+            return '[%s]' % ','.join(self._render(part, values) for part in parts)
+        rendered = []
+        for part in parts:
+            if isinstance(part, str):
+                rendered.append(part)
+                continue
+            member, sub = part
+            if sub[0] == 'var' and values[sub[1]] is None:
+                continue
+            rendered.append(member + self._render(sub, values))
+        return '{%s}' % ','.join(rendered)
+
+    def render(self, **values):
+        """:param **values: value of each Var by name
+        :returns: JSON request body, pass it as payload or body to Postmen calls
+        :rtype: str
+        :raises KeyError: value of a Var is not given"""
+        return self._render(self._node, values)
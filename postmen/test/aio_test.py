@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from postmen import AsyncPostmen
+from postmen import PostmenException
+from postmen.buffered import BufferedResponse
+from postmen.middleware import Middleware
+from postmen.cassette import Cassette
+
+headers = {"x-ratelimit-reset": "1453435538946", "x-ratelimit-remaining": "10", "x-ratelimit-limit": "10"}
+ok = b'{"meta":{"code":200,"message":"OK","details":[]},"data":{"key":"value"}}'
+problem = b'{"meta":{"code":999,"message":"PROBLEM","retryable":true,"details":[]},"data":{}}'
+
+class FakeAsyncPostmen(AsyncPostmen):
+    """Answer calls with given bodies in order, the last one repeats"""
+    def __init__(self, bodies, *args, **kwargs):
+        super(FakeAsyncPostmen, self).__init__(*args, **kwargs)
+        self.bodies = bodies
+        self.sent = []
+        self.slept = []
+
+    async def _request(self, params):
+        self.sent.append(params)
+        body = self.bodies[min(len(self.sent), len(self.bodies)) - 1]
+        return BufferedResponse(200, headers, body)
+
+    async def _sleep(self, sec):
+        self.slept.append(sec)
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def testAsyncCall():
+    api = FakeAsyncPostmen([ok], 'KEY', 'REGION')
+    ret = run(api.create('labels', {'something': 'value'}))
+    assert ret['key'] == 'value'
+    assert api.sent[0]['method'] == 'POST'
+    assert api.sent[0]['url'] == 'https://REGION-api.postmen.com/v3/labels'
+    assert api.sent[0]['data'] == '{"something": "value"}'
+
+def testAsyncRetry():
+    api = FakeAsyncPostmen([problem, problem, ok], 'KEY', 'REGION')
+    ret = run(api.get('labels', 'ID'))
+    assert ret['key'] == 'value'
+    assert len(api.sent) == 3
+    assert api.sent[0]['url'] == 'https://REGION-api.postmen.com/v3/labels/ID'
+    assert len(api.slept) == 2
+
+def testAsyncRaise():
+    api = FakeAsyncPostmen([problem], 'KEY', 'REGION', retry=False)
+    with pytest.raises(PostmenException) as e:
+        run(api.get('labels'))
+    assert 999 == e.value.code()
+    assert len(api.sent) == 1
+
+def testAsyncSafeErrorPerTask():
+    api = FakeAsyncPostmen([problem], 'KEY', 'REGION', safe=True)
+    async def failing():
+        ret = await api.get('labels')
+        return ret, api.getError()
+    async def main():
+        failed = asyncio.ensure_future(failing())
+        await asyncio.sleep(0)
+        return await failed, api.getError()
+    (ret, error), other_task_error = run(main())
+    assert ret is None
+    assert "PROBLEM" in error.message()
+    assert other_task_error is None
+    assert len(api.sent) == 5
+
+def testAsyncCreateMany():
+    api = FakeAsyncPostmen([ok, problem, ok], 'KEY', 'REGION', retry=False)
+    ret = run(api.create_many('labels', [{'n': n} for n in range(3)], concurrency=2))
+    assert ret[0]['key'] == 'value'
+    assert isinstance(ret[1], PostmenException)
+    assert ret[2]['key'] == 'value'
+
+def testAsyncMiddleware():
+    events = []
+    class Recorder(Middleware):
+        def before_attempt(self, context):
+            events.append(('attempt', context.attempt))
+        def send(self, context, params, send):
+            events.append(('send', params['url']))
+            return send(params)
+        def after_call(self, context, result, error):
+            events.append(('done', result, error))
+    class Replay(Middleware):
+        def send(self, context, params, send):
+            return BufferedResponse(200, headers, ok)
+    api = FakeAsyncPostmen([problem, ok], 'KEY', 'REGION', middleware=[Recorder()])
+    assert run(api.get('labels', 'ID')) == {'key': 'value'}
+    url = 'https://REGION-api.postmen.com/v3/labels/ID'
+    assert events == [('attempt', 1), ('send', url), ('attempt', 2), ('send', url), ('done', {'key': 'value'}, None)]
+    api = FakeAsyncPostmen([problem], 'KEY', 'REGION', middleware=[Replay()])
+    assert run(api.get('labels', 'ID')) == {'key': 'value'}
+    assert api.sent == []
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def testAsyncIterResources(prefetch):
+    pages = [
+        b'{"meta":{"code":200,"message":"OK","details":[]},"data":{"next_token":"1","labels":[{"id":1},{"id":2}]}}',
+        b'{"meta":{"code":200,"message":"OK","details":[]},"data":{"labels":[{"id":3}]}}'
+    ]
+    api = FakeAsyncPostmen(pages, 'KEY', 'REGION')
+    async def collect():
+        return [label['id'] async for label in api.iter_resources('labels', query={'limit': 2}, prefetch=prefetch)]
+    assert run(collect()) == [1, 2, 3]
+    assert [sent['params'] for sent in api.sent] == [{'limit': 2}, {'limit': 2, 'next_token': '1'}]
+    api = FakeAsyncPostmen([problem], 'KEY', 'REGION', retry=False)
+    with pytest.raises(PostmenException):
+        run(collect())
+
+def testAsyncUnsupported(tmpdir):
+    api = FakeAsyncPostmen([ok], 'KEY', 'REGION')
+    with pytest.raises(TypeError):
+        api.stream_resources('labels')
+    with pytest.raises(TypeError):
+        api.download_label_files(['ID'], str(tmpdir))
+    with pytest.raises(TypeError):
+        api.get_label_file('ID')
+    assert api.sent == []
+
+def testAsyncCassette(tmpdir):
+    with Cassette(str(tmpdir.join('aio.jsonl.gz')), 'auto', latency=0.25) as cassette:
+        api = FakeAsyncPostmen([ok], 'KEY', 'REGION', cassette=cassette)
+        assert run(api.get('labels', 'ID')) == {'key': 'value'}
+        assert run(api.get('labels', 'ID')) == {'key': 'value'}
+    assert len(api.sent) == 1
+    assert api.slept == [0.25]
@@ -5,11 +5,41 @@ import traceback
 import responses
 import requests
 import time
+import sys
+import re
+import threading
+import json
+import os
+import multiprocessing
+import socket
+import zlib
+import gzip
+import six
 
-from datetime import datetime
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from datetime import datetime, timedelta
+from dateutil.tz import tzutc
 
 from postmen import Postmen
 from postmen import PostmenException
+from postmen import PostmenDeadlineException
+from postmen import ratelimit
+from postmen.jsont import JSONWithDatetimeDecoder
+from postmen.jsonbackend import get_backend
+from postmen import cache as cache_module
+from postmen.cache import ResponseCache, RateQuoteCache, LabelFileCache, payload_hash
+from decimal import Decimal
+from postmen.buffered import BufferedResponse
+from postmen.stream import JSONArrayStream
+from postmen.template import PayloadTemplate, Var
+from postmen.middleware import Middleware
+from postmen.cassette import Cassette
+from postmen.metrics import Metrics
+from postmen.tracing import Tracer, InMemoryExporter, CallbackExporter, TimedHTTPAdapter
+from postmen.retry import RetryPolicy, RetryBudget
+from postmen.ratelimit import PacingRateLimiter, SharedRateLimiter, RateLimitExceeded
 
 headers = {"x-ratelimit-reset": "1453435538946", "x-ratelimit-remaining": "10", "x-ratelimit-limit": "10"}
 exceeded = {"x-ratelimit-reset": "1453435538946", "x-ratelimit-remaining": "0", "x-ratelimit-limit": "10"}
@@ -420,6 +450,1027 @@ def testTime():
     assert res['when'].second == 46
     responses.reset()
 
+# TEST pooled session
+@responses.activate
+def testSessionReused():
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=response, status=200)
+    api = Postmen('KEY', 'REGION', pool_maxsize=4)
+    session = api._session
+    api.get('labels')
+    api.get('labels')
+    assert api._session is session
+    adapter = session.get_adapter('https://region-api.postmen.com/v3/labels')
+    assert adapter._pool_maxsize == 4
+    assert responses.calls[0].request.headers['connection'] == 'keep-alive'
+    responses.reset()
+
+# TEST keep alive and context manager
+@responses.activate
+def testSessionClose(monkeypatch):
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=response, status=200)
+    closed = []
+    with Postmen('KEY', 'REGION', keep_alive=False) as api:
+        monkeypatch.setattr(api._session, 'close', lambda: closed.append(True))
+        api.get('labels')
+    assert closed == [True]
+    assert responses.calls[0].request.headers['connection'] == 'close'
+    responses.reset()
+
+# TEST one instance shared by many threads
+def testThreadSafety():
+    server = StubServer()
+    try:
+        api = Postmen('KEY', endpoint=server.url, safe=True, retry=False, pool_maxsize=16)
+        failures = []
+        def worker(n):
+            for i in range(20):
+                if i % 2:
+                    ret = api.get('labels', 'bad-%d-%d' % (n, i))
+                    e = api.getError()
+                    if ret is not None or e is None or e.message() != 'bad-%d-%d' % (n, i):
+                        failures.append((n, i, e))
+                else:
+                    ret = api.get('labels', 'good-%d-%d' % (n, i))
+                    if ret != {'id': 'good-%d-%d' % (n, i)} or api.getError() is not None:
+                        failures.append((n, i, ret))
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert failures == []
+        assert server.calls == 16 * 20
+        assert isinstance(api._rate_limiter.calls_left(), int)
+    finally:
+        server.close()
+
+# TEST bulk calls keep input order and report errors per item
+def testGetMany():
+    server = StubServer()
+    try:
+        api = Postmen('KEY', endpoint=server.url, retry=False)
+        ids = ['bad-%d' % i if i % 3 == 0 else 'good-%d' % i for i in range(30)]
+        ret = api.get_many('labels', ids, concurrency=8)
+        assert len(ret) == 30
+        for id_, item in zip(ids, ret):
+            if id_.startswith('bad'):
+                assert isinstance(item, PostmenException)
+                assert item.message() == id_
+            else:
+                assert item == {'id': id_}
+        assert server.calls == 30
+    finally:
+        server.close()
+
+@responses.activate
+def testCreateMany():
+    def request_callback(request):
+        payload = json.loads(request.body)
+        if payload['n'] == 2:
+            return (200, headers, '{"meta":{"code":4104,"message":"INVALID","details":[]},"data":{}}')
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"n":%d}}' % payload['n'])
+    responses.add_callback(responses.POST, 'https://region-api.postmen.com/v3/labels', callback=request_callback)
+    api = Postmen('KEY', 'REGION', safe=True)
+    ret = api.create_many('labels', [{'n': n} for n in range(5)], concurrency=3)
+    assert [r['n'] for r in ret if not isinstance(r, PostmenException)] == [0, 1, 3, 4]
+    assert ret[2].message() == 'INVALID'
+    assert len(responses.calls) == 5
+    responses.reset()
+
+# TEST pacing spreads calls evenly over rate limit window
+def testPacingRateLimiter(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit, '_monotonic', lambda: now[0])
+    monkeypatch.setattr(time, 'time', lambda: 1453435538.0)
+    limiter = PacingRateLimiter()
+    assert limiter.acquire() == 0
+    limiter.update({'x-ratelimit-limit': '10', 'x-ratelimit-remaining': '4', 'x-ratelimit-reset': '1453435540000'})
+    delays = [limiter.acquire() for i in range(4)]
+    assert delays == [pytest.approx(d) for d in [0, 0.5, 1.0, 1.5]]
+    assert limiter.acquire() == pytest.approx(2.0)
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(block=False)
+    now[0] += 2.5
+    assert limiter.acquire() == pytest.approx(0)
+    assert limiter.calls_left() == 9
+
+@responses.activate
+def testPacing(monkeypatch):
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{}}'
+    reset = str(int((time.time() + 1) * 1000))
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers={"x-ratelimit-reset": reset, "x-ratelimit-remaining": "5", "x-ratelimit-limit": "10"}, body=response, status=200)
+    api = Postmen('KEY', 'REGION', pacing=True)
+    delays = []
+    monkeypatch.setattr(api, '_delay', delays.append)
+    for i in range(3):
+        api.get('labels')
+    assert len(delays) == 1
+    assert 0 < delays[0] <= 0.2
+    responses.reset()
+
+# TEST quota shared between processes
+def testSharedRateLimiter(tmpdir, monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: 1453435538.0)
+    path = str(tmpdir.join('ratelimit'))
+    first = SharedRateLimiter(path)
+    second = SharedRateLimiter(path)
+    assert second.acquire() == 0
+    first.update({'x-ratelimit-limit': '10', 'x-ratelimit-remaining': '4', 'x-ratelimit-reset': '1453435540000'})
+    assert second.calls_left() == 4
+    delays = [first.acquire(), second.acquire(), first.acquire(), second.acquire()]
+    assert delays == [pytest.approx(d) for d in [0, 0.5, 1.0, 1.5]]
+    with pytest.raises(RateLimitExceeded):
+        first.acquire(block=False)
+    first.close()
+    second.close()
+    monkeypatch.setattr(ratelimit, 'fcntl', None)
+    with pytest.raises(OSError):
+        SharedRateLimiter(path)
+
+def acquireShared(path):
+    limiter = SharedRateLimiter(path, burst=100)
+    sent = 0
+    for i in range(10):
+        try:
+            limiter.acquire(block=False)
+            sent += 1
+        except RateLimitExceeded:
+            pass
+    return sent
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def testSharedRateLimiterProcesses(tmpdir):
+    path = str(tmpdir.join('ratelimit'))
+    limiter = SharedRateLimiter(path, burst=100)
+    reset = str(int((time.time() + 60) * 1000))
+    limiter.update({'x-ratelimit-limit': '25', 'x-ratelimit-remaining': '25', 'x-ratelimit-reset': reset})
+    pool = multiprocessing.Pool(4)
+    try:
+        sent = pool.map(acquireShared, [path] * 4)
+    finally:
+        pool.close()
+        pool.join()
+    assert sum(sent) == 25
+    assert limiter.calls_left() == 0
+
+# TEST decorrelated jitter, time budget and retry budget
+def testRetryPolicy(monkeypatch):
+    e = PostmenException(message='PROBLEM', retryable=True)
+    policy = RetryPolicy(base=1.0, cap=5.0, budget=None)
+    previous = 0
+    for count in range(1, 5):
+        delay = policy.delay(e, count, previous, 0)
+        assert 1.0 <= delay <= min(5.0, max(previous, 1.0) * 3)
+        previous = delay
+    assert policy.delay(e, 5, previous, 0) is None
+    assert policy.delay(PostmenException(message='PROBLEM'), 1, 0, 0) is None
+    policy = RetryPolicy(base=1.0, cap=1.0, max_elapsed=10, budget=None)
+    assert policy.delay(e, 1, 0, 8.5) == 1.0
+    assert policy.delay(e, 1, 0, 9.5) is None
+    budget = RetryBudget(ratio=0.5, min_per_second=0, capacity=2)
+    policy = RetryPolicy(budget=budget)
+    assert policy.delay(e, 1, 0, 0) is not None
+    assert policy.delay(e, 1, 0, 0) is not None
+    assert policy.delay(e, 1, 0, 0) is None
+    policy.started()
+    policy.started()
+    assert policy.delay(e, 1, 0, 0) is not None
+
+# TEST retry by HTTP status and transport errors
+@responses.activate
+def testRetryStatus(monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda s: None)
+    global call
+    call = 0
+    def request_callback(request):
+        global call
+        call += 1
+        if call == 1:
+            return (503, {}, '<html>Service Unavailable</html>')
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"key":"value"}}')
+    responses.add_callback(responses.POST, 'https://region-api.postmen.com/v3/labels', callback=request_callback)
+    api = Postmen('KEY', 'REGION')
+    assert api.create('labels', {})['key'] == 'value'
+    assert call == 2
+    responses.reset()
+
+@responses.activate
+def testRetryTransport(monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda s: None)
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', body=requests.exceptions.ReadTimeout('timed out'))
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/labels', body=requests.exceptions.ReadTimeout('timed out'))
+    api = Postmen('KEY', 'REGION')
+    with pytest.raises(PostmenException) as e:
+        api.get('labels')
+    assert e.value.retryable()
+    assert len(responses.calls) == 5
+    with pytest.raises(PostmenException) as e:
+        api.create('labels', {})
+    assert "Failed to perform HTTP request" in e.value.message()
+    assert not e.value.retryable()
+    assert len(responses.calls) == 6
+    responses.reset()
+
+def testRetryConnectionRefused(monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda s: None)
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    api = Postmen('KEY', endpoint='http://127.0.0.1:%d' % port, stale_retries=0, retry_policy=RetryPolicy(tries=2, budget=None))
+    with pytest.raises(PostmenException) as e:
+        api.create('labels', {})
+    assert e.value.retryable()
+
+# TEST timeouts and call deadline
+def testTimeout():
+    api = FakePostmen('KEY', 'REGION')
+    assert api.get('resource')['timeout'] == (10, 60)
+    assert api.get('resource', timeout=5)['timeout'] == 5
+    api = FakePostmen('KEY', 'REGION', timeout=None)
+    assert api.get('resource')['timeout'] is None
+    assert api._deadline_timeout((10, 60), ratelimit._monotonic() + 2)[1] <= 2
+    assert api._deadline_timeout(None, ratelimit._monotonic() + 2)[0] <= 2
+
+@responses.activate
+def testDeadline(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+    response = '{"meta":{"code":999,"message":"PROBLEM","retryable":true,"details":[]},"data":{}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=response, status=200)
+    api = Postmen('KEY', 'REGION', deadline=0.5)
+    with pytest.raises(PostmenDeadlineException) as e:
+        api.get('labels')
+    assert e.value.retryable()
+    assert e.value.code() == 408
+    assert e.value.details() == ['PROBLEM']
+    assert len(responses.calls) == 1
+    assert slept == []
+    responses.reset()
+
+@responses.activate
+def testDeadlineRateLimit(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{}}'
+    reset = str(int((time.time() + 30) * 1000))
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers={"x-ratelimit-reset": reset, "x-ratelimit-remaining": "0", "x-ratelimit-limit": "10"}, body=response, status=200)
+    api = Postmen('KEY', 'REGION', safe=True)
+    api.get('labels')
+    assert api.get('labels', deadline=5) is None
+    assert isinstance(api.getError(), PostmenDeadlineException)
+    assert len(responses.calls) == 1
+    assert slept == []
+    responses.reset()
+
+# TEST calls given up on deadline do not use rate limit quota or retry budget
+def testDeadlineReservesNothing(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit, '_monotonic', lambda: now[0])
+    monkeypatch.setattr(time, 'time', lambda: 1453435538.0)
+    rate_headers = {'x-ratelimit-limit': '10', 'x-ratelimit-remaining': '4', 'x-ratelimit-reset': '1453435540000'}
+    limiter = ratelimit.RateLimiter()
+    limiter.update(rate_headers)
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(max_delay=0)
+    assert limiter.calls_left() == 4
+    limiter = PacingRateLimiter()
+    limiter.update(rate_headers)
+    assert limiter.acquire() == 0
+    with pytest.raises(RateLimitExceeded) as e:
+        limiter.acquire(max_delay=0.2)
+    assert e.value.delay == pytest.approx(0.5)
+    assert limiter.calls_left() == 3
+    assert limiter.acquire(max_delay=1) == pytest.approx(0.5)
+    budget = RetryBudget(ratio=0, min_per_second=0, capacity=1)
+    policy = RetryPolicy(base=1, cap=1, budget=budget)
+    error = PostmenException(message='PROBLEM', retryable=True)
+    assert policy.delay(error, 1, 0, 0, max_delay=0.5) == 1
+    assert budget.withdraw()
+
+# TEST only strict ISO-8601 strings become datetime
+def testTimeStrict():
+    s = '{"created_at": "2016-01-31T16:45:46.123+08:00", "updated_at": "2016-01-31T16:45:46Z", "ship_date": "2016-02-01", ' \
+        '"postal_code": "10001", "zip": "1000-1234", "bad": "2016-13-31T16:45:46Z", "name": "2016-01-31 sale", ' \
+        '"dates": ["2016-01-31T16:45:46+00:00", "x"], "nested": {"created_at": "2016-01-31T16:45:46-05:30"}}'
+    ret = json.loads(s, cls=JSONWithDatetimeDecoder)
+    assert ret['created_at'] == datetime(2016, 1, 31, 8, 45, 46, 123000, tzinfo=tzutc())
+    assert ret['created_at'].utcoffset() == timedelta(hours=8)
+    assert ret['updated_at'] == datetime(2016, 1, 31, 16, 45, 46, tzinfo=tzutc())
+    assert ret['ship_date'] == datetime(2016, 2, 1)
+    assert ret['postal_code'] == '10001'
+    assert ret['zip'] == '1000-1234'
+    assert ret['bad'] == '2016-13-31T16:45:46Z'
+    assert ret['name'] == '2016-01-31 sale'
+    assert ret['dates'][0] == datetime(2016, 1, 31, 16, 45, 46, tzinfo=tzutc())
+    assert ret['dates'][1] == 'x'
+    assert ret['nested']['created_at'].utcoffset() == -timedelta(hours=5, minutes=30)
+    assert ret == JSONWithDatetimeDecoder().handleObj(json.loads(s))
+    ret = json.loads(s, cls=JSONWithDatetimeDecoder, keys=['created_at'])
+    assert isinstance(ret['created_at'], datetime)
+    assert isinstance(ret['nested']['created_at'], datetime)
+    assert ret['updated_at'] == '2016-01-31T16:45:46Z'
+    assert ret == JSONWithDatetimeDecoder(keys=['created_at']).handleObj(json.loads(s))
+    # $ would match before a trailing newline
+    assert json.loads('["2016-01-01\\n", "2016-01-31T16:45:46Z\\n"]', cls=JSONWithDatetimeDecoder) == ['2016-01-01\n', '2016-01-31T16:45:46Z\n']
+
+@responses.activate
+def testTimeKeys():
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"created_at": "2016-01-31T16:45:46+00:00", "ship_date": "2016-02-01"}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=response, status=200)
+    api = Postmen('KEY', 'REGION', time=['created_at'])
+    res = api.get('labels')
+    assert isinstance(res['created_at'], datetime)
+    assert res['ship_date'] == '2016-02-01'
+    responses.reset()
+
+# TEST JSON backends encode and decode like jsont
+@pytest.mark.parametrize('name', ['stdlib', 'orjson', 'rapidjson', 'ujson'])
+def testJSONBackend(name):
+    try:
+        backend = get_backend(name)
+    except ImportError:
+        pytest.skip('%s is not installed' % name)
+    payload = {'when': datetime(2016, 1, 31, 16, 45, 46, tzinfo=tzutc()), 'items': [1, 2.5, None, u'é'], 'nested': {'ok': True}}
+    data = backend.dumps(payload)
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    assert json.loads(data.decode('utf-8')) == json.loads(get_backend('stdlib').dumps(payload))
+    s = '{"created_at": "2016-01-31T16:45:46+00:00", "postal_code": "10001", "list": [{"updated_at": "2016-02-01"}]}'.encode('utf-8')
+    assert backend.loads(s) == json.loads(s.decode('utf-8'))
+    assert backend.loads(s, True) == json.loads(s.decode('utf-8'), cls=JSONWithDatetimeDecoder)
+    assert backend.loads(s, ['updated_at']) == json.loads(s.decode('utf-8'), cls=JSONWithDatetimeDecoder, keys=['updated_at'])
+    with pytest.raises(ValueError):
+        backend.loads(b'THIS IS NOT A VALID JSON OBJECT')
+
+@responses.activate
+def testJSONBackendOption():
+    pytest.importorskip('orjson')
+    def request_callback(request):
+        assert json.loads(request.body) == {'when': '2016-01-31T16:45:46'}
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"when":"2016-01-31T16:45:46"}}')
+    responses.add_callback(responses.POST, 'https://region-api.postmen.com/v3/labels', callback=request_callback)
+    api = Postmen('KEY', 'REGION', json_backend='orjson', time=True)
+    ret = api.create('labels', {'when': datetime(2016, 1, 31, 16, 45, 46)})
+    assert ret['when'] == datetime(2016, 1, 31, 16, 45, 46)
+    assert len(responses.calls) == 1
+    responses.reset()
+    with pytest.raises(PostmenException) as e:
+        Postmen('KEY', 'REGION', json_backend='nosuchjson')
+    assert 'nosuchjson' in e.value.message()
+
+# TEST GET response cache
+@responses.activate
+def testResponseCache():
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"ID"}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels/ID', adding_headers=headers, body=response, status=200)
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=response, status=200)
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/cancel-labels', adding_headers=headers, body=response, status=200)
+    cache = ResponseCache()
+    api = Postmen('KEY', 'REGION', cache=cache)
+    assert api.get('labels', 'ID') == {'id': 'ID'}
+    assert api.get('labels', 'ID') == {'id': 'ID'}
+    assert api.get('labels', 'ID', time=True) == {'id': 'ID'}
+    assert len(responses.calls) == 1
+    api.get('labels', query={'limit': 10, 'status': 'created'})
+    api.get('labels', query='status=created&limit=10')
+    assert len(responses.calls) == 2
+    api.get('labels', 'ID', cache=False)
+    api.get('labels', 'ID', cache='refresh')
+    api.get('labels', 'ID')
+    assert len(responses.calls) == 4
+    api.create('cancel-labels', {'label': {'id': 'ID'}})
+    api.get('labels', 'ID')
+    assert len(responses.calls) == 6
+    assert cache.stats()['hits'] == 4
+    api.invalidate_cache('labels')
+    assert cache.stats()['entries'] == 0
+    # cache=False skips reading and storing only, the change still drops stale responses
+    api.get('labels', 'ID')
+    api.create('cancel-labels', {'label': {'id': 'ID'}}, cache=False)
+    api.get('labels', 'ID')
+    assert len(responses.calls) == 9
+    responses.reset()
+
+@responses.activate
+def testResponseCacheAccounts():
+    def request_callback(request):
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"owner":"%s"}}' % request.headers['postmen-api-key'])
+    responses.add_callback(responses.GET, 'https://region-api.postmen.com/v3/labels', callback=request_callback)
+    cache = ResponseCache()
+    a = Postmen('KEY-A', 'REGION', cache=cache)
+    b = Postmen('KEY-B', 'REGION', cache=cache)
+    assert a.get('labels') == {'owner': 'KEY-A'}
+    assert b.get('labels') == {'owner': 'KEY-B'}
+    assert Postmen('KEY-A', 'REGION', cache=cache).get('labels') == {'owner': 'KEY-A'}
+    assert len(responses.calls) == 2
+    responses.reset()
+
+def testResponseCacheEviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, '_monotonic', lambda: now[0])
+    cache = ResponseCache(ttl=10, max_entries=2, max_bytes=10)
+    cache.set('a', 'labels', BufferedResponse(200, {}, b'1234'))
+    cache.set('b', 'labels', BufferedResponse(200, {}, b'1234'))
+    assert cache.get('a').content == b'1234'
+    cache.set('c', 'rates', BufferedResponse(200, {}, b'1234'))
+    assert cache.get('b') is None
+    cache.set('d', 'rates', BufferedResponse(200, {}, b'12345678'))
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['bytes'] == 8
+    cache.set('e', 'rates', BufferedResponse(200, {}, b'12345678901'))
+    assert cache.get('e') is None
+    now[0] += 11
+    assert cache.get('d') is None
+    assert cache.stats()['bytes'] == 0
+
+# TEST rate quotes memoized by canonical payload
+def testPayloadHash():
+    a = {'shipper_accounts': [{'id': 'X'}], 'shipment': {'parcels': [{'weight': {'value': 1.0, 'unit': 'kg'}}], 'ship_to': {'city': 'A', 'street2': None}}, 'async': False}
+    b = '{"async": false, "shipment": {"ship_to": {"city": "A"}, "parcels": [{"weight": {"unit": "kg", "value": 1}}]}, "shipper_accounts": [{"id": "X"}]}'
+    c = {'shipper_accounts': [{'id': 'X'}], 'shipment': {'parcels': [{'weight': {'value': Decimal('1.00'), 'unit': 'kg'}}], 'ship_to': {'city': 'A'}}, 'async': False}
+    assert payload_hash(a) == payload_hash(b) == payload_hash(c)
+    a['shipment']['parcels'][0]['weight']['value'] = 1.5
+    assert payload_hash(a) != payload_hash(b)
+
+@responses.activate
+def testRateQuoteCache():
+    calculated = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"status":"calculated","rates":[]}}'
+    calculating = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"status":"calculating","rates":[]}}'
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/rates', adding_headers=headers, body=calculating, status=200)
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/rates', adding_headers=headers, body=calculated, status=200)
+    rate_cache = RateQuoteCache(ttl=60)
+    api = Postmen('KEY', 'REGION', rate_cache=rate_cache)
+    payload = {'shipment': {'parcels': [{'weight': {'value': 1.0, 'unit': 'kg'}}]}, 'async': False}
+    assert api.create('rates', payload)['status'] == 'calculating'
+    assert api.create('rates', payload)['status'] == 'calculated'
+    assert api.create('rates', {'async': False, 'shipment': {'parcels': [{'weight': {'unit': 'kg', 'value': 1}}]}})['status'] == 'calculated'
+    assert api.create('rates', payload, raw=True) == calculated
+    assert len(responses.calls) == 2
+    api.create('rates', payload, cache=False)
+    api.create('rates', {'shipment': payload['shipment'], 'async': True})
+    assert len(responses.calls) == 4
+    assert rate_cache.stats()['hits'] == 2
+    assert rate_cache.stats()['misses'] == 3
+    responses.reset()
+
+@pytest.mark.parametrize('raw', [True, 'bytes'])
+@responses.activate
+def testRateQuoteCacheRaw(raw):
+    calculating = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"status":"calculating","rates":[]}}'
+    calculated = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"status":"calculated","rates":[]}}'
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/rates', adding_headers=headers, body=calculating, status=200)
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/rates', adding_headers=headers, body=calculated, status=200)
+    api = Postmen('KEY', 'REGION', rate_cache=RateQuoteCache())
+    payload = {'shipment': {'parcels': [{'weight': {'value': 1.0, 'unit': 'kg'}}]}, 'async': False}
+    ret = api.create('rates', payload, raw=raw)
+    assert (ret if raw == 'bytes' else ret.encode('utf-8')) == calculating.encode('utf-8')
+    assert api.create('rates', payload)['status'] == 'calculated'
+    assert api.create('rates', payload)['status'] == 'calculated'
+    assert len(responses.calls) == 2
+    responses.reset()
+
+@responses.activate
+def testRateQuoteCacheAccounts():
+    def request_callback(request):
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"status":"calculated","rates":[],"owner":"%s"}}' % request.headers['postmen-api-key'])
+    responses.add_callback(responses.POST, 'https://region-api.postmen.com/v3/rates', callback=request_callback)
+    rate_cache = RateQuoteCache()
+    payload = {'shipment': {'parcels': [{'weight': {'value': 1.0, 'unit': 'kg'}}]}, 'async': False}
+    assert Postmen('KEY-A', 'REGION', rate_cache=rate_cache).create('rates', payload)['owner'] == 'KEY-A'
+    assert Postmen('KEY-B', 'REGION', rate_cache=rate_cache).create('rates', payload)['owner'] == 'KEY-B'
+    assert Postmen('KEY-A', 'REGION', rate_cache=rate_cache).create('rates', payload)['owner'] == 'KEY-A'
+    assert len(responses.calls) == 2
+    responses.reset()
+
+# TEST iterate over all pages
+@pytest.mark.parametrize('prefetch', [0, 1, 3])
+@responses.activate
+def testIterResources(prefetch):
+    def request_callback(request):
+        query = dict(six.moves.urllib.parse.parse_qsl(six.moves.urllib.parse.urlparse(request.url).query))
+        assert query['limit'] == '2'
+        page = int(query.get('next_token', '0'))
+        data = {'limit': 2, 'cancel_labels': [{'id': page * 2 + i} for i in range(2)]}
+        if page < 3:
+            data['next_token'] = str(page + 1)
+        return (200, headers, json.dumps({'meta': {'code': 200, 'message': 'OK', 'details': []}, 'data': data}))
+    responses.add_callback(responses.GET, 'https://region-api.postmen.com/v3/cancel-labels', callback=request_callback)
+    api = Postmen('KEY', 'REGION')
+    ret = [item['id'] for item in api.iter_resources('cancel-labels', query={'limit': 2}, prefetch=prefetch)]
+    assert ret == list(range(8))
+    assert len(responses.calls) == 4
+    responses.reset()
+
+@responses.activate
+def testIterResourcesError():
+    def request_callback(request):
+        if 'next_token' in request.url:
+            return (200, headers, '{"meta":{"code":999,"message":"PROBLEM","details":[]},"data":{}}')
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"next_token":"1","labels":[{"id":1}]}}')
+    responses.add_callback(responses.GET, 'https://region-api.postmen.com/v3/labels', callback=request_callback)
+    api = Postmen('KEY', 'REGION', safe=True)
+    items = api.iter_resources('labels')
+    assert next(items) == {'id': 1}
+    with pytest.raises(PostmenException) as e:
+        next(items)
+    assert 'PROBLEM' in e.value.message()
+    responses.reset()
+
+def testJSONArrayStreamChunks():
+    doc = {'data': {'next_token': 'x', 'labels': [{'id': i, 'text': 'a"b\\c ]}', 'n': [1.5, None, {'k': []}]} for i in range(20)] + [7, -1e3]}, 'meta': {'code': 200}}
+    text = json.dumps(doc).encode('utf-8')
+    for size in (1, 3, 7, 64, len(text)):
+        parser = JSONArrayStream(('data', 'labels'), (('meta',),))
+        found = []
+        for i in range(0, len(text), size):
+            found += parser.feed(text[i:i + size])
+        found += parser.feed(b'', True)
+        assert [json.loads(t) for kind, path, t in found if kind == 'item'] == doc['data']['labels']
+        assert [json.loads(t) for kind, path, t in found if kind == 'capture'] == [doc['meta']]
+    with pytest.raises(ValueError):
+        JSONArrayStream(('data',)).feed(b'{"data": [1, 2', True)
+
+@responses.activate
+def testStreamResources():
+    body = json.dumps({'meta': {'code': 200, 'message': 'OK', 'details': []}, 'data': {'labels': [{'id': i, 'created_at': '2016-01-31T16:45:46+00:00'} for i in range(100)]}})
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', body=body, status=200, headers=headers)
+    api = Postmen('KEY', 'REGION', time=True)
+    ret = list(api.stream_resources('labels', query={'limit': 100}, chunk_size=50))
+    assert [item['id'] for item in ret] == list(range(100))
+    assert ret[0]['created_at'] == datetime(2016, 1, 31, 16, 45, 46, tzinfo=tzutc())
+    assert 'limit=100' in responses.calls[0].request.url
+    responses.reset()
+
+@responses.activate
+def testStreamResourcesError():
+    # meta before data, error raised before any object
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', status=200, headers=headers,
+        body='{"meta":{"code":4104,"message":"PROBLEM","details":[]},"data":{"labels":[{"id":1}]}}')
+    api = Postmen('KEY', 'REGION', safe=True)
+    with pytest.raises(PostmenException) as e:
+        next(api.stream_resources('labels'))
+    assert e.value.code() == 4104
+    responses.reset()
+    # meta after data, objects received before the error are yielded
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', status=200, headers=headers,
+        body='{"data":{"labels":[{"id":1}]},"meta":{"code":4104,"message":"PROBLEM","details":[]}}')
+    items = api.stream_resources('labels')
+    assert next(items) == {'id': 1}
+    with pytest.raises(PostmenException) as e:
+        next(items)
+    assert e.value.message() == 'PROBLEM'
+    responses.reset()
+    # HTTP error is parsed as usual
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', status=401, headers=headers,
+        body='{"meta":{"code":4101,"message":"Invalid API key","details":[]},"data":{}}')
+    with pytest.raises(PostmenException) as e:
+        list(api.stream_resources('labels'))
+    assert e.value.code() == 4101
+    responses.reset()
+
+@responses.activate
+def testRawBytes():
+    body = b'{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"1234567890","name":"\\u0436"}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels/1234567890', body=body, status=200, headers=headers)
+    api = Postmen('KEY', 'REGION', raw='bytes')
+    ret = api.get('labels', '1234567890')
+    assert isinstance(ret, bytes)
+    assert ret == body
+    responses.reset()
+
+@responses.activate
+def testRawBytesError():
+    body = b'{"meta":{"code":4104,"message":"PROBLEM","details":[]},"data":{}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', body=body, status=200, headers=headers)
+    api = Postmen('KEY', 'REGION', raw='bytes')
+    with pytest.raises(PostmenException) as e:
+        api.get('labels')
+    assert e.value.code() == 4104
+    assert e.value.message() == 'PROBLEM'
+    responses.reset()
+    # meta.code not found by the quick check, body is parsed
+    body = b'{"data":{},"meta":{"details":[{"info":"x"}],"code":200,"message":"OK"}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', body=body, status=200, headers=headers)
+    assert api.get('labels') == body
+    responses.reset()
+    # data first with a nested meta, the top level error is still found by the full parse
+    body = b'{"data":{"order":{"meta":{"code":200}}},"meta":{"code":4104,"message":"PROBLEM","details":[]}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', body=body, status=200, headers=headers)
+    with pytest.raises(PostmenException) as e:
+        api.get('labels')
+    assert e.value.code() == 4104
+    responses.reset()
+
+def testPayloadTemplate():
+    created = datetime(2016, 1, 31, 16, 45, 46, tzinfo=tzutc())
+    template = PayloadTemplate({
+        'async': False,
+        'created_at': created,
+        'references': Var('references'),
+        'shipment': {
+            'ship_from': {'contact_name': 'sender', 'street2': None},
+            'ship_to': Var('receiver'),
+            'parcels': [{'weight': {'value': 1.5, 'unit': 'kg'}, 'items': Var('items')}]
+        }
+    })
+    body = template.render(receiver={'contact_name': 'receiver', 'street2': None}, items=[{'quantity': 2}], references=None)
+    assert ' ' not in body
+    assert json.loads(body) == {
+        'async': False,
+        'created_at': created.isoformat(),
+        'shipment': {
+            'ship_from': {'contact_name': 'sender'},
+            'ship_to': {'contact_name': 'receiver'},
+            'parcels': [{'weight': {'value': 1.5, 'unit': 'kg'}, 'items': [{'quantity': 2}]}]
+        }
+    }
+    assert json.loads(template.render(receiver={}, items=[], references=['ref']))['references'] == ['ref']
+    with pytest.raises(KeyError):
+        template.render(receiver={})
+    assert PayloadTemplate({'a': None, 'b': [1, None]}).render() == '{"b":[1,null]}'
+
+@responses.activate
+def testPayloadTemplateCall():
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"ID"}}'
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=response, status=200)
+    template = PayloadTemplate({'shipper_account': {'id': 'SHIPPER'}, 'shipment': {'ship_to': Var('receiver')}})
+    api = Postmen('KEY', 'REGION')
+    api.create('labels', template.render(receiver={'country': 'RUS'}))
+    assert json.loads(responses.calls[0].request.body) == {'shipper_account': {'id': 'SHIPPER'}, 'shipment': {'ship_to': {'country': 'RUS'}}}
+    responses.reset()
+
+@responses.activate
+def testCompressRequest():
+    response = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"ID"}}'
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=response, status=200)
+    api = Postmen('KEY', 'REGION', compress='gzip', compress_threshold=100)
+    payload = {'items': [{'description': 'Food Bar', 'quantity': 2}] * 50}
+    api.create('labels', payload)
+    request = responses.calls[0].request
+    assert request.headers['content-encoding'] == 'gzip'
+    assert request.headers['accept-encoding'] == 'gzip, deflate'
+    assert json.loads(zlib.decompress(request.body, 16 + zlib.MAX_WBITS).decode('utf-8')) == payload
+    counts = api.getByteCounts()
+    assert counts['request'] == len(request.body)
+    assert counts['request_uncompressed'] > counts['request'] * 5
+    # small bodies and compress=False calls are sent as is
+    api.create('labels', {'id': 1})
+    api.create('labels', payload, compress=False)
+    assert 'content-encoding' not in responses.calls[1].request.headers
+    assert 'content-encoding' not in responses.calls[2].request.headers
+    assert api.getByteCounts()['request'] == api.getByteCounts()['request_uncompressed']
+    responses.reset()
+    api = Postmen('KEY', 'REGION', compress='brotli', safe=True)
+    assert 'brotli' in api.getError().message()
+
+@responses.activate
+def testCompressedResponseByteCounts():
+    data = {'labels': [{'id': str(i), 'status': 'created'} for i in range(200)]}
+    body = json.dumps({'meta': {'code': 200, 'message': 'OK', 'details': []}, 'data': data}).encode('utf-8')
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = compressor.compress(body) + compressor.flush()
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', body=compressed, status=200,
+        headers=dict(headers, **{'content-encoding': 'gzip'}))
+    api = Postmen('KEY', 'REGION')
+    assert api.getByteCounts() is None
+    assert api.get('labels') == data
+    counts = api.getByteCounts()
+    assert counts['response'] == len(compressed)
+    assert counts['response_decoded'] == len(body)
+    assert counts['request'] == 0
+    assert len(list(api.stream_resources('labels', chunk_size=100))) == 200
+    counts = api.getByteCounts()
+    assert counts['response'] == len(compressed)
+    assert counts['response_decoded'] == len(body)
+    responses.reset()
+
+@responses.activate
+def testDownloadLabelFiles(tmpdir):
+    files = {'1': b'%PDF-1' * 10000, '2': b'\x89PNG' * 5000}
+    def file_callback(request):
+        assert 'postmen-api-key' not in request.headers
+        name = request.url.rsplit('/', 1)[1]
+        return (200, {'content-length': str(len(files[name]))}, files[name])
+    responses.add_callback(responses.GET, re.compile(r'https://files\.example\.com/label/.*'), callback=file_callback)
+    label = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"ID2","files":{"label":{"url":"https://files.example.com/label/2","file_type":"png"}}}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels/ID2', adding_headers=headers, body=label, status=200)
+    api = Postmen('KEY', 'REGION')
+    labels = [
+        {'id': 'ID1', 'files': {'label': {'url': 'https://files.example.com/label/1', 'file_type': 'pdf'}}},
+        'ID2',
+        {'id': 'ID3', 'files': {}}
+    ]
+    dest = str(tmpdir.join('labels'))
+    ret = api.download_label_files(labels, dest, concurrency=2, chunk_size=1000)
+    assert ret[0] == os.path.join(dest, 'ID1.pdf')
+    assert ret[1] == os.path.join(dest, 'ID2.png')
+    assert isinstance(ret[2], PostmenException)
+    with open(ret[0], 'rb') as f:
+        assert f.read() == files['1']
+    with open(ret[1], 'rb') as f:
+        assert f.read() == files['2']
+    assert sorted(os.listdir(dest)) == ['ID1.pdf', 'ID2.png']
+    responses.reset()
+
+@responses.activate
+def testDownloadLabelFilesIncomplete(tmpdir):
+    responses.add(responses.GET, 'https://files.example.com/label/1', body=b'short', status=200, adding_headers={'content-length': '100'})
+    responses.add(responses.GET, 'https://files.example.com/label/2', body=b'', status=404)
+    api = Postmen('KEY', 'REGION', retry=False)
+    labels = [{'id': str(i), 'files': {'label': {'url': 'https://files.example.com/label/%d' % i}}} for i in (1, 2)]
+    ret = api.download_label_files(labels, str(tmpdir))
+    assert ret[0].retryable()
+    assert ret[1].code() == 404
+    # no partial files are left behind
+    assert os.listdir(str(tmpdir)) == []
+    responses.reset()
+
+@responses.activate
+def testDownloadLabelFilesDeadline(tmpdir, monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+    responses.add(responses.GET, 'https://files.example.com/label/1', body=b'', status=503)
+    api = Postmen('KEY', 'REGION', deadline=0.5)
+    ret = api.download_label_files([{'id': '1', 'files': {'label': {'url': 'https://files.example.com/label/1'}}}], str(tmpdir))
+    assert isinstance(ret[0], PostmenDeadlineException)
+    assert len(responses.calls) == 1
+    assert slept == []
+    responses.reset()
+
+@responses.activate
+def testGetLabelFile(tmpdir):
+    content = b'%PDF-1' * 1000
+    responses.add(responses.GET, 'https://files.example.com/label/1.pdf', body=content, status=200)
+    label = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"ID1","files":{"label":{"url":"https://files.example.com/label/1.pdf"}}}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels/ID1', adding_headers=headers, body=label, status=200)
+    cache = LabelFileCache(str(tmpdir))
+    api = Postmen('KEY', 'REGION', label_cache=cache)
+    data = api.get_label_file('ID1')
+    assert data[:] == content
+    data.close()
+    assert len(responses.calls) == 2
+    # reprints by id or label object are served from disk
+    data = api.get_label_file('ID1')
+    assert data[:6] == b'%PDF-1'
+    data.close()
+    data = api.get_label_file({'id': 'ID1', 'files': {'label': {'url': 'https://files.example.com/label/1.pdf'}}})
+    assert len(data) == len(content)
+    data.close()
+    assert len(responses.calls) == 2
+    assert cache.stats() == {'files': 1, 'bytes': len(content)}
+    with pytest.raises(PostmenException):
+        Postmen('KEY', 'REGION').get_label_file('ID1')
+    responses.reset()
+
+def testLabelFileCacheEviction(tmpdir):
+    cache = LabelFileCache(str(tmpdir), max_bytes=2500)
+    def writer(size):
+        def download(path):
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+        return download
+    first = cache.store('ID1', 'https://files.example.com/1.pdf', writer(1000))
+    second = cache.store('ID2', 'https://files.example.com/2.pdf', writer(1000))
+    # mtime resolution may be coarse, make the order explicit
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    data = cache.open(first)
+    data.close()
+    cache.store('ID3', 'https://files.example.com/3.pdf', writer(1000))
+    assert cache.find('ID1') == first
+    assert cache.find('ID2') is None
+    assert cache.find('ID3', 'https://files.example.com/3.pdf') is not None
+    assert cache.stats() == {'files': 2, 'bytes': 2000}
+    # storing a cached file again replaces it, the cache does not grow and is not scanned for eviction
+    evictions = []
+    cache._evict = evictions.append
+    for _ in range(3):
+        cache.store('ID3', 'https://files.example.com/3.pdf', writer(1000))
+    assert evictions == []
+    assert cache.find('ID1') == first
+    assert cache.stats() == {'files': 2, 'bytes': 2000}
+
+class RecordingMiddleware(Middleware):
+    def __init__(self):
+        self.events = []
+
+    def __getattribute__(self, name):
+        attr = object.__getattribute__(self, name)
+        if name in ('events', 'send') or name.startswith('_'):
+            return attr
+        def hook(context, *args):
+            self.events.append(name)
+            return attr(context, *args)
+        return hook
+
+    def after_serialize(self, context, params):
+        params['headers'] = dict(params['headers'], **{'x-request-id': 'REQ%d' % context.attempt})
+
+@responses.activate
+def testMiddlewareHooks():
+    calls = {'count': 0}
+    def request_callback(request):
+        calls['count'] += 1
+        if calls['count'] == 1:
+            return (200, headers, '{"meta":{"code":999,"message":"PROBLEM","retryable":true,"details":[]},"data":{}}')
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"ID"}}')
+    responses.add_callback(responses.GET, 'https://region-api.postmen.com/v3/labels/ID', callback=request_callback)
+    recorder = RecordingMiddleware()
+    api = Postmen('KEY', 'REGION', middleware=[recorder])
+    api._delay = lambda sec: None
+    assert api.get('labels', 'ID') == {'id': 'ID'}
+    attempt = ['before_attempt', 'after_serialize', 'after_rate_limit', 'after_response']
+    assert recorder.events == ['before_call'] + attempt + ['after_attempt', 'before_retry'] + attempt + ['after_parse', 'after_attempt', 'after_call']
+    assert responses.calls[1].request.headers['x-request-id'] == 'REQ2'
+    responses.reset()
+
+# TEST headers changed in place by middleware belong to one request only
+@responses.activate
+def testMiddlewareHeaders():
+    class RequestId(Middleware):
+        def after_serialize(self, context, params):
+            if context.path.endswith('ID1'):
+                params['headers']['x-request-id'] = 'REQ1'
+    for name in ('ID1', 'ID2'):
+        responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels/%s' % name, adding_headers=headers, body='{"meta":{"code":200,"message":"OK","details":[]},"data":{}}', status=200)
+    api = Postmen('KEY', 'REGION', middleware=[RequestId()])
+    api.get('labels', 'ID1')
+    api.get('labels', 'ID2')
+    assert responses.calls[0].request.headers['x-request-id'] == 'REQ1'
+    assert 'x-request-id' not in responses.calls[1].request.headers
+    assert 'x-request-id' not in api._headers
+    responses.reset()
+
+def testMiddlewareSend():
+    class Replay(Middleware):
+        def send(self, context, params, send):
+            assert context.resource == 'labels'
+            return BufferedResponse(200, {}, b'{"meta":{"code":200,"message":"OK","details":[]},"data":{"url":"%s"}}' % params['url'].encode('utf-8'), 'utf-8')
+    class Crash(Middleware):
+        def __init__(self):
+            self.errors = []
+        def send(self, context, params, send):
+            raise PostmenException(message='injected', code=503, retryable=False)
+        def after_call(self, context, result, error):
+            self.errors.append(error)
+    # no network access, the response comes from middleware
+    api = Postmen('KEY', 'REGION', middleware=[Replay()])
+    assert api.get('labels', 'ID')['url'] == 'https://REGION-api.postmen.com/v3/labels/ID'
+    crash = Crash()
+    api = Postmen('KEY', 'REGION', middleware=[crash], safe=True)
+    assert api.get('labels', 'ID') is None
+    assert api.getError().message() == 'injected'
+    assert crash.errors[0].code() == 503
+
+@responses.activate
+def testMetrics():
+    calls = {'count': 0}
+    def request_callback(request):
+        calls['count'] += 1
+        if calls['count'] == 1:
+            return (200, headers, '{"meta":{"code":999,"message":"PROBLEM","retryable":true,"details":[]},"data":{}}')
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"ID"}}')
+    responses.add_callback(responses.GET, 'https://region-api.postmen.com/v3/labels/ID', callback=request_callback)
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, status=200,
+        body='{"meta":{"code":4104,"message":"PROBLEM","details":[]},"data":{}}')
+    metrics = Metrics(buckets=(1.0, 10.0))
+    api = Postmen('KEY', 'REGION', middleware=[metrics], safe=True)
+    api._delay = lambda sec: None
+    api.get('labels', 'ID')
+    api.create('labels', {'id': 'ID'})
+    snapshot = metrics.snapshot()
+    get = snapshot['GET labels']
+    assert get['calls'] == 1
+    assert get['retries'] == 1
+    assert get['errors'] == {}
+    assert get['retry_wait'] >= 1.0
+    assert get['response_bytes'] > 0
+    assert get['latency']['count'] == 1
+    assert get['latency']['buckets'][-1] == (float('inf'), 1)
+    post = snapshot['POST labels']
+    assert post['errors'] == {4104: 1}
+    assert post['request_bytes'] == len('{"id": "ID"}')
+    text = metrics.prometheus()
+    assert '# TYPE postmen_calls_total counter' in text
+    assert 'postmen_calls_total{method="GET",resource="labels"} 1' in text
+    assert 'postmen_errors_total{method="POST",resource="labels",code="4104"} 1' in text
+    assert 'postmen_call_duration_seconds_bucket{method="GET",resource="labels",le="+Inf"} 1' in text
+    assert 'postmen_call_duration_seconds_count{method="POST",resource="labels"} 1' in text
+    responses.reset()
+
+def testTracing():
+    server = StubServer()
+    try:
+        exporter = InMemoryExporter()
+        logged = []
+        tracers = [Tracer(exporter), Tracer(CallbackExporter(lambda span: logged.append(span.to_dict())))]
+        api = Postmen('KEY', endpoint=server.url, middleware=tracers, retry=False)
+        api.get('labels', 'good-1')
+        api.get('labels', 'good-2')
+        first, second = exporter.spans
+        assert first.attributes['method'] == 'GET'
+        assert first.attributes['attempts'] == 1
+        attempt, = first.children
+        assert [span.name for span in attempt.children] == ['serialize', 'rate_limit_wait', 'http', 'parse']
+        http, = attempt.find('http')
+        # the first call opens the connection, the second one reuses it
+        assert [span.name for span in http.children] == ['connect', 'wait', 'read']
+        assert [span.name for span in second.find('http')[0].children] == ['wait', 'read']
+        for span in first.find('attempt')[0].children:
+            assert attempt.start <= span.start <= span.end <= attempt.end
+        assert first.duration >= attempt.duration
+        assert len(logged) == 2
+        assert logged[0]['children'][0]['children'][2]['attributes'] == {'status_code': 200}
+    finally:
+        server.close()
+        api.close()
+
+def testTracingOptIn():
+    # connect time is measured only for objects with a Tracer
+    for middleware in [None, [Metrics()]]:
+        adapter = Postmen('KEY', 'REGION', middleware=middleware)._session.get_adapter('https://')
+        assert type(adapter) is requests.adapters.HTTPAdapter
+    adapter = Postmen('KEY', 'REGION', middleware=[Tracer(InMemoryExporter())])._session.get_adapter('https://')
+    assert isinstance(adapter, TimedHTTPAdapter)
+
+@responses.activate
+def testTracingRetries():
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, status=200,
+        body='{"meta":{"code":999,"message":"PROBLEM","retryable":true,"details":[]},"data":{}}')
+    exporter = InMemoryExporter()
+    api = Postmen('KEY', 'REGION', middleware=[Tracer(exporter)], safe=True, retry_policy=RetryPolicy(tries=3, base=0.01, cap=0.01, budget=None))
+    api.get('labels')
+    call, = exporter.spans
+    assert [span.name for span in call.children] == ['attempt', 'retry_wait', 'attempt', 'retry_wait', 'attempt']
+    assert [span.attributes['error'] for span in call.find('attempt')] == [999, 999, 999]
+    assert call.attributes['error'] == 999
+    assert call.find('retry_wait')[0].duration >= 0.01
+    responses.reset()
+
+@responses.activate
+def testCassetteRecordReplay(tmpdir):
+    labels = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"labels":[{"id":"ID"}]}}'
+    created = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"NEW"}}'
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=labels, status=200)
+    responses.add(responses.POST, 'https://region-api.postmen.com/v3/labels', adding_headers=headers, body=created, status=200)
+    path = str(tmpdir.join('labels.jsonl.gz'))
+    with Cassette(path, 'record') as cassette:
+        api = Postmen('KEY', 'REGION', cassette=cassette, compress='gzip', compress_threshold=0)
+        assert api.get('labels', query={'limit': 2, 'status': 'created'}) == {'labels': [{'id': 'ID'}]}
+        assert api.create('labels', {'b': 1, 'a': None}) == {'id': 'NEW'}
+    assert len(responses.calls) == 2
+    with gzip.open(path, 'rb') as f:
+        lines = [json.loads(line.decode('utf-8')) for line in f]
+    assert [line['request'].split(' ')[:2] for line in lines] == [['GET', '/v3/labels?limit=2&status=created'], ['POST', '/v3/labels']]
+    assert 'x-ratelimit-reset' not in lines[0]['headers']
+    # other endpoint, query order and equal body still match, nothing is sent
+    cassette = Cassette(path, latency=0.5)
+    slept = []
+    api = Postmen('KEY', 'OTHER', cassette=cassette)
+    api._delay = slept.append
+    assert api.get('labels', query='?status=created&limit=2') == {'labels': [{'id': 'ID'}]}
+    assert api.create('labels', '{"b": 1.0}') == {'id': 'NEW'}
+    assert list(api.stream_resources('labels', query={'status': 'created', 'limit': 2})) == [{'id': 'ID'}]
+    assert len(responses.calls) == 2
+    assert slept == [0.5, 0.5, 0.5]
+    with pytest.raises(PostmenException) as e:
+        api.create('labels', {'b': 2})
+    assert e.value.message() == 'request is not recorded in cassette'
+    assert cassette.stats() == {'requests': 2, 'responses': 2, 'replayed': 3, 'recorded': 0, 'misses': 1}
+    responses.reset()
+
+@responses.activate
+def testCassetteAuto(tmpdir):
+    calls = {'count': 0}
+    def request_callback(request):
+        calls['count'] += 1
+        return (200, headers, '{"meta":{"code":200,"message":"OK","details":[]},"data":{"n":%d}}' % calls['count'])
+    responses.add_callback(responses.GET, 'https://region-api.postmen.com/v3/labels/ID', callback=request_callback)
+    responses.add(responses.GET, 'https://region-api.postmen.com/v3/labels/ID2', adding_headers=headers, status=200,
+        body='{"meta":{"code":4153,"message":"PROBLEM","details":[]},"data":{}}')
+    path = str(tmpdir.join('auto.jsonl.gz'))
+    with Cassette(path, 'record') as cassette:
+        api = Postmen('KEY', 'REGION', cassette=cassette)
+        api.get('labels', 'ID')
+        api.get('labels', 'ID')
+    # recorded responses of a request are replayed in turn
+    with Cassette(path, 'auto') as cassette:
+        api = Postmen('KEY', 'REGION', cassette=cassette)
+        assert [api.get('labels', 'ID')['n'] for _ in range(3)] == [1, 2, 1]
+        # API errors are recorded and replayed as well
+        for _ in range(2):
+            assert api.get('labels', 'ID2', safe=True) is None
+            assert api.getError().code() == 4153
+        assert cassette.stats()['misses'] == 1
+        assert cassette.stats()['recorded'] == 1
+    assert calls['count'] == 2
+    assert len(responses.calls) == 3
+    assert Cassette(path).stats()['requests'] == 2
+    responses.reset()
+
 class OptionsPostmen(Postmen):
     def __init__(self, *args, **kwargs):
         super(OptionsPostmen, self).__init__(*args, **kwargs)
@@ -493,3 +1544,48 @@ class CrashPostmen(Postmen):
 
     def _wrap_request(self, **kwargs):
         raise Exception('requests failed')
+
+class StubServer(object):
+    """Local Postmen API stub, GET /v3/labels/good-* succeeds and /v3/labels/bad-* fails with id as error message"""
+    def __init__(self):
+        stub = self
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.calls += 1
+                    remaining = 1000 - stub.calls
+                id_ = self.path.rsplit('/', 1)[-1]
+                if id_.startswith('bad'):
+                    body = '{"meta":{"code":4104,"message":"%s","details":[]},"data":{}}' % id_
+                else:
+                    body = '{"meta":{"code":200,"message":"OK","details":[]},"data":{"id":"%s"}}' % id_
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(body)))
+                self.send_header('x-ratelimit-limit', '1000')
+                self.send_header('x-ratelimit-remaining', str(remaining))
+                self.send_header('x-ratelimit-reset', str(int((time.time() + 60) * 1000)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,227 @@
+"""Tracing middleware records a span tree of every call: call, one span per attempt with serialize,
+rate_limit_wait, http (connect, wait, read) and parse phases, and retry_wait between attempts.
+Finished trees are passed to an exporter.
+"""
+
+import threading
+from collections import deque
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection, HTTPSConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .ratelimit import _monotonic
+from .middleware import Middleware
+
+# time spent connecting (TCP and TLS) by the calling thread since the last reset
+_connect_local = threading.local()
+
+
+def _reset_connect_time():
+    _connect_local.time = 0.0
+
+
+def _connect_time():
+    return getattr(_connect_local, 'time', 0.0)
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = _monotonic()
+        try:
+            HTTPConnection.connect(self)
+        finally:
+            _connect_local.time = _connect_time() + _monotonic() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = _monotonic()
+        try:
+            HTTPSConnection.connect(self)
+        finally:
+            _connect_local.time = _connect_time() + _monotonic() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter measuring connect time of new connections, read by Tracer. Postmen mounts it
+    only when a Tracer is in its middleware."""
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+
+class Span(object):
+    """Timed phase of a call, times are monotonic seconds.
+
+    :ivar name: phase name
+    :ivar start: start time
+    :ivar end: end time, None while the span is open
+    :ivar attributes: dict of span details (e.g. attempt number, error code)
+    :ivar children: list of child spans
+    """
+    def __init__(self, name, start, end=None, **attributes):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attributes = attributes
+        self.children = []
+
+    @property
+    def duration(self):
+        """:returns: seconds, None while the span is open
+        :rtype: float"""
+        return None if self.end is None else self.end - self.start
+
+    def child(self, name, start, end=None, **attributes):
+        """:returns: new child span
+        :rtype: Span"""
+        span = Span(name, start, end, **attributes)
+        self.children.append(span)
+        return span
+
+    def find(self, name):
+        """:returns: spans of the tree with given name, depth first
+        :rtype: list of Span"""
+        found = [self] if self.name == name else []
+        for child in self.children:
+            found.extend(child.find(name))
+        return found
+
+    def to_dict(self, origin=None):
+        """:param origin: time start is relative to, span start by default
+        :returns: name, start, duration, attributes and children, times in seconds
+        :rtype: dict"""
+        origin = self.start if origin is None else origin
+        return {
+            'name': self.name,
+            'start': self.start - origin,
+            'duration': self.duration,
+            'attributes': dict(self.attributes),
+            'children': [child.to_dict(origin) for child in self.children]
+        }
+
+
+class InMemoryExporter(object):
+    """Keep the last max_spans call spans in memory, for tests and debugging.
+
+    :param max_spans: number of call spans kept
+    :type max_spans: int
+    """
+    def __init__(self, max_spans=1000):
+        self._spans = deque(maxlen=max_spans)
+
+    def export(self, span):
+        self._spans.append(span)
+
+    @property
+    def spans(self):
+        """:rtype: list of Span"""
+        return list(self._spans)
+
+    def clear(self):
+        self._spans.clear()
+
+
+class CallbackExporter(object):
+    """Pass every call span to callback, e.g. to attach timings to own request logs.
+
+    :param callback: function called with the call span
+    :type callback: callable
+    """
+    def __init__(self, callback):
+        self._callback = callback
+
+    def export(self, span):
+        self._callback(span)
+
+
+class Tracer(Middleware):
+    """Record span tree of every call and pass it to exporter when the call ends.
+
+    Example::
+
+        exporter = InMemoryExporter()
+        api = Postmen(api_key, region, middleware=[Tracer(exporter)])
+
+    :param exporter: receives the call span, an object with export(span) method
+    :type exporter: InMemoryExporter or CallbackExporter
+    """
+    def __init__(self, exporter):
+        self._exporter = exporter
+
+    def before_call(self, context):
+        context.data[self] = {
+            'call': Span('call', context.start, method=context.method, path=context.path),
+            'attempt': None,
+            'mark': None
+        }
+
+    def before_attempt(self, context):
+        trace = context.data[self]
+        now = _monotonic()
+        retry_wait = trace.pop('retry_wait', None)
+        if retry_wait is not None:
+            retry_wait.end = now
+        trace['attempt'] = trace['call'].child('attempt', now, number=context.attempt)
+        trace['mark'] = now
+
+    def _phase(self, context, name, **attributes):
+        # close phase started at the previous mark
+        trace = context.data[self]
+        now = _monotonic()
+        span = trace['attempt'].child(name, trace['mark'], now, **attributes)
+        trace['mark'] = now
+        return span
+
+    def after_serialize(self, context, params):
+        self._phase(context, 'serialize')
+
+    def after_rate_limit(self, context, delay):
+        self._phase(context, 'rate_limit_wait')
+        _reset_connect_time()
+
+    def after_response(self, context, response):
+        span = self._phase(context, 'http', status_code=response.status_code)
+        connect = _connect_time()
+        elapsed = getattr(response, 'elapsed', None)
+        if connect > 0:
+            span.child('connect', span.start, span.start + connect)
+        if elapsed is not None:
+            # requests elapsed: from sending the request until response headers are parsed
+            headers_at = min(span.start + elapsed.total_seconds(), span.end)
+            span.child('wait', span.start + min(connect, headers_at - span.start), headers_at)
+            span.child('read', headers_at, span.end)
+
+    def after_parse(self, context, result):
+        self._phase(context, 'parse')
+
+    def after_attempt(self, context, error):
+        attempt = context.data[self]['attempt']
+        attempt.end = _monotonic()
+        if error is not None:
+            attempt.attributes['error'] = error.code()
+
+    def before_retry(self, context, error, delay):
+        trace = context.data[self]
+        trace['retry_wait'] = trace['call'].child('retry_wait', _monotonic(), delay=delay)
+
+    def after_call(self, context, result, error):
+        call = context.data[self]['call']
+        call.end = _monotonic()
+        call.attributes['attempts'] = context.attempt
+        call.attributes['cached'] = context.cached
+        if error is not None:
+            call.attributes['error'] = error.code() if hasattr(error, 'code') else str(error)
+        self._exporter.export(call)
@@ -71,7 +71,11 @@ setup(
         'requests>=2.7.0',
         'python-dateutil>=2.4.2',
         'six>=1.9.0',
+        'futures>=3.0; python_version < "3"',
     ],
+    extras_require={
+        'async': ['aiohttp>=3.0'],
+    },
     tests_require=[
         'pytest'
     ]